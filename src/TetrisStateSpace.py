@@ -21,7 +21,9 @@ This single transition accounts for all of the other ones, excluding those that
 (e.g. gravity, etc), which will be implemented in our simulator and not the state space.
 """
 
-import copy
+import random
+from array import array
+from collections import OrderedDict
 
 """
 Mappings of each tetris type and possible orientations to a 2D array representings its values.
@@ -95,11 +97,28 @@ SHAPES = {
 class TetrisStateSpace:
     """
     Valid tetrimones, defined columns and rows constants
+
+    Internally the board is stored as a tuple of ROWS integers, one per row, where bit c of a row is set when
+    column c of that row is filled. Collision, landing and full-row checks are then single mask operations
+    instead of cell by cell loops. The familiar list of rows view is still available through `board`.
+
+    The rows, like the skyline below, are immutable and shared: a successor only builds the rows the piece
+    touched and reuses every other row of its parent, clones share all of them, and the `board` view is made
+    of interned row tuples (ROW_CELLS) so no state ever allocates its own cells.
+
+    States are identified by a Zobrist hash: `board_hash` XORs one random key per (row, row mask), and `zobrist`
+    adds one key per (queue slot, piece). place_piece updates the board hash from its parent's by swapping the
+    keys of the rows the piece touched, so hashing a successor costs a handful of XORs.
+
+    A state reached through place_piece also remembers the move that produced it in `placement`, as the
+    (landing height, eroded piece cells) pair the Dellacherie evaluator scores; it is None for states built
+    through the constructors.
     """
     VALID_SHAPES = {"O", "I", "S", "Z", "L", "J", "T"}
     COLUMNS = 10
     ROWS = 20
-    
+    FULL_ROW = (1 << COLUMNS) - 1
+
     def __init__(self, board, queue, lines, cache=True):
         """
         Instantiate this state space and validate provided variables
@@ -123,89 +142,338 @@ class TetrisStateSpace:
                 if cell not in (0, 1):
                     raise ValueError("board cells must be 0 or 1")
 
+        self._validate_queue_and_lines(queue, lines)
+
+        # Assignments
+        self.rows = tuple(self._pack_row(row) for row in board)
+        self.queue = list(queue)
+        self.lines = lines
+        self.cache = cache
+        self.cached_placements = {}
+        self.cached_grids = {}
+        self._board = None
+        self._heights = None
+        self._column_holes = None
+        self._board_hash = None
+        self._features = None
+        self.placement = None
+
+    @classmethod
+    def from_rows(cls, rows, queue, lines, cache=True):
+        """
+        Instantiate a state space directly from packed rows (one 10-bit integer per row),
+        validating the provided variables.
+        """
+        if not isinstance(rows, (list, tuple)):
+            raise TypeError("rows must be a list/tuple of integers")
+
+        if len(rows) != cls.ROWS:
+            raise ValueError("rows must have exactly 20 entries")
+
+        for row in rows:
+            if not isinstance(row, int):
+                raise TypeError("packed rows must be integers")
+
+            if row < 0 or row > cls.FULL_ROW:
+                raise ValueError("packed rows must fit in 10 bits")
+
+        cls._validate_queue_and_lines(queue, lines)
+
+        return cls._trusted(tuple(rows), list(queue), lines, cache)
+
+    @classmethod
+    def _trusted(cls, rows, queue, lines, cache=True, heights=None, column_holes=None, board_hash=None,
+                 cached_grids=None, cached_placements=None, features=None, placement=None):
+        """
+        Fast path constructor for states the engine builds itself (successors and clones).
+        Nothing is validated or copied: the caller hands over a rows tuple, a queue list it will not
+        mutate again, and optionally the skyline tuples, board hash, placement caches and features it
+        already has for this exact board, and the placement that produced it. External callers should go
+        through the validating constructors instead.
+        """
+        state = cls.__new__(cls)
+        state.rows = rows
+        state.queue = queue
+        state.lines = lines
+        state.cache = cache
+        state.cached_placements = cached_placements if cached_placements is not None else {}
+        state.cached_grids = cached_grids if cached_grids is not None else {}
+        state._board = None
+        state._heights = heights
+        state._column_holes = column_holes
+        state._board_hash = board_hash
+        state._features = features
+        state.placement = placement
+
+        return state
+
+    @classmethod
+    def _validate_queue_and_lines(cls, queue, lines):
+        """
+        Validates the next queue and the lines count shared by both constructors
+        """
         # Validate queue
         if not (isinstance(queue, (list, tuple)) and len(queue) == 3):
             raise ValueError("next must be a list/tuple of length 3")
 
         for shape in queue:
-            if shape not in self.VALID_SHAPES:
+            if shape not in cls.VALID_SHAPES:
                 raise ValueError(f"invalid piece '{shape}' in next queue")
 
         # Validate lines
         if not isinstance(lines, int):
             raise TypeError("lines must be an integer")
 
-        if lines < 0: 
+        if lines < 0:
             raise ValueError("lines cannot be negative")
 
-        # Assignments
-        self.board = board
-        self.queue = list(queue)
-        self.lines = lines
-        self.cache = cache
-        self.cached_placements = None
-        self.cached_grids = {}
+    @staticmethod
+    def _pack_row(row):
+        """
+        Packs a list of 0/1 cells into an integer with bit c set when column c is filled
+        """
+        mask = 0
 
+        for c, cell in enumerate(row):
+            if cell == 1:
+                mask |= 1 << c
 
-    def _occupied_cells(self, grid, row, col):
+        return mask
+
+    @property
+    def board(self):
         """
-        Given a grid representing a shape in some orientation, the desired row and column for the
-        shape to be dropped, return a list of (x, y) coordinates in the main board representing
-        the tiles that need to be filled. If there is some contradiction, for example one or more
-        of the tiles is already occupied or if 
+        The board as a list of 20 rows of 10 0/1 cells, looked up from the row masks on first access.
+        Rows are shared, immutable tuples; copy a row into a list before changing its cells.
         """
-        cells = []
+        if self._board is None:
+            self._board = [ROW_CELLS[mask] for mask in self.rows]
 
-        for i, grid_row in enumerate(grid):
-            for j, cell in enumerate(grid_row):
-                if cell == 1:
-                    board_i = row + i
-                    board_j = col + j
+        return self._board
 
-                    if board_i < 0 or board_i >= self.ROWS or board_j < 0 or board_j >= self.COLUMNS:
-                        return None
+    @property
+    def board_hash(self):
+        """
+        Zobrist hash of the board alone, computed on first access unless inherited from the parent.
+        """
+        if self._board_hash is None:
+            board_hash = 0
 
-                    if self.board[board_i][board_j] == 1:
-                        return None
+            for keys, mask in zip(ROW_ZOBRIST_KEYS, self.rows):
+                board_hash ^= keys[mask]
 
-                    cells.append((board_i, board_j))
+            self._board_hash = board_hash
 
-        return cells
-    
-    def _drop_location(self, piece, col, orientation):
+        return self._board_hash
+
+    @property
+    def zobrist(self):
         """
-        Given a grid representing a shape in some orientation and a target column,
-        return the list of (row, col) cells where the piece would come to rest
-        if dropped straight down in that column. Return None if it cannot be
-        placed anywhere in that column.
+        Zobrist hash of the board and the next queue. The lines count is not part of it.
+        """
+        queue = self.queue
+        return self.board_hash ^ QUEUE_ZOBRIST_KEYS[0][queue[0]] ^ QUEUE_ZOBRIST_KEYS[1][queue[1]] ^ QUEUE_ZOBRIST_KEYS[2][queue[2]]
+
+    def zobrist_prefix(self, pieces):
         """
-        key = (piece, col, orientation)
+        Zobrist hash of the board and only the first `pieces` entries of the queue. A search that will
+        only ever place (or check) those pieces can use it to treat states that differ further down the
+        queue as the same position.
+        """
+        queue_hash = self.board_hash
+
+        for i in range(pieces):
+            queue_hash ^= QUEUE_ZOBRIST_KEYS[i][self.queue[i]]
+
+        return queue_hash
 
-        if self.cache and key in self.cached_grids:
-            return self.cached_grids[key]
-            
-        grid = SHAPES[piece][orientation]
-        grid_height = len(grid)
-        last_cells = None
+    @property
+    def heights(self):
+        """
+        Height of each column, measured from the floor to the top filled cell (0 for an empty column).
+        """
+        if self._heights is None:
+            self._compute_skyline()
+
+        return self._heights
+
+    @property
+    def column_holes(self):
+        """
+        Number of empty cells below the top filled cell of each column.
+        """
+        if self._column_holes is None:
+            self._compute_skyline()
 
-        for row in range(self.ROWS - grid_height + 1):
-            cells = self._occupied_cells(grid, row, col)
+        return self._column_holes
+
+    @property
+    def holes(self):
+        """
+        Total number of holes on the board.
+        """
+        return sum(self.column_holes)
+
+    @property
+    def features(self):
+        """
+        (aggregate height, holes, bumpiness) of the board, the board features of the agents' heuristic.
+        place_piece hands them down from the parent and only updates the columns the piece touched,
+        so scoring a successor does not need to look at its board at all.
+        """
+        if self._features is None:
+            self._features = skyline_features(self.heights, self.column_holes)
+
+        return self._features
+
+    def _compute_skyline(self):
+        """
+        Computes the column heights and holes from scratch by sweeping the rows top down,
+        keeping a mask of every column that has been covered by a block so far.
+        """
+        heights = [0] * self.COLUMNS
+        column_holes = [0] * self.COLUMNS
+        covered = 0
+
+        for r, mask in enumerate(self.rows):
+            # columns whose top block sits in this row
+            tops = mask & ~covered
+            covered |= mask
+            gaps = covered & ~mask
+
+            while tops:
+                low = tops & -tops
+                heights[low.bit_length() - 1] = self.ROWS - r
+                tops ^= low
+
+            while gaps:
+                low = gaps & -gaps
+                column_holes[low.bit_length() - 1] += 1
+                gaps ^= low
+
+        self._heights = tuple(heights)
+        self._column_holes = tuple(column_holes)
+
+    def _scan_column(self, rows, c):
+        """
+        Returns the (height, holes) of a single column c of the provided rows.
+        """
+        bit = 1 << c
+        height = 0
+        holes = 0
 
-            if cells is None:
+        for r, mask in enumerate(rows):
+            if mask & bit:
+                if not height:
+                    height = self.ROWS - r
+            elif height:
+                holes += 1
+
+        return height, holes
+
+    def _scan_drop_row(self, table, col):
+        """
+        Slides the shape down from the top row by row using mask checks and returns the last row it fits in,
+        or None if it collides straight away.
+        """
+        shifted = table.column_masks[col]
+        rows = self.rows
+        last_row = None
+
+        for row in range(self.ROWS - table.height + 1):
+            if any(rows[row + i] & mask for i, mask in shifted):
                 break
 
-            last_cells = cells
+            last_row = row
+
+        return last_row
+
+    def _landing_row(self, piece, col, orientation):
+        """
+        Given a piece, a target column and an orientation, return the board row the top of the
+        piece's grid comes to rest in when dropped straight down in that column, or None if it
+        cannot be placed anywhere in that column.
+        """
+        key = (col, orientation)
 
         if self.cache:
-            self.cached_grids[key] = last_cells
+            # landing rows are cached per piece so that they can be handed around as one dict
+            grids = self.cached_grids.get(piece)
 
-        return last_cells
+            if grids is None:
+                grids = self.cached_grids[piece] = {}
+            elif key in grids:
+                return grids[key]
+
+        table = PIECE_TABLES[piece][orientation]
+        last_row = None
+
+        if 0 <= col <= self.COLUMNS - table.width:
+            # the piece comes to rest as soon as one of its columns touches the skyline
+            heights = self.heights
+            last_row = self.ROWS - table.height
+
+            for j in range(table.width):
+                height = heights[col + j]
+
+                if self.ROWS - height < table.top[j]:
+                    # the column's top block is above where the piece spawns, so the skyline says nothing
+                    # about where it stops and we have to slide the piece down the rows instead
+                    last_row = self._scan_drop_row(table, col)
+                    break
+
+                row = self.ROWS - 1 - height - table.bottom[j]
+
+                if row < last_row:
+                    last_row = row
+
+            if last_row is not None and last_row < 0:
+                last_row = None
+
+        if self.cache:
+            grids[key] = last_row
+
+        return last_row
+
+    def _drop_location(self, piece, col, orientation):
+        """
+        Given a piece, a target column and an orientation,
+        return the list of (row, col) cells where the piece would come to rest
+        if dropped straight down in that column. Return None if it cannot be
+        placed anywhere in that column.
+        """
+        row = self._landing_row(piece, col, orientation)
+
+        if row is None:
+            return None
+
+        return [(row + i, c) for (i, c) in PIECE_TABLES[piece][orientation].column_cells[col]]
+
+    def pack(self):
+        """
+        A compact, picklable form of this state for sending it to another process: the rows as 40 bytes,
+        the queue as a 3 character string, the lines count and the placement that produced the state.
+        Caches and skyline are left behind and rebuilt on the other side as needed.
+        """
+        return array("H", self.rows).tobytes(), "".join(self.queue), self.lines, self.placement
+
+    @classmethod
+    def unpack(cls, packed, cache=True):
+        """
+        Rebuilds a state from the output of pack
+        """
+        rows, queue, lines, placement = packed
+        return cls._trusted(tuple(array("H", rows)), list(queue), lines, cache, placement=placement)
 
     def clone(self):
         """
         Clones this state space
         """
-        return TetrisStateSpace(copy.deepcopy(self.board), self.queue.copy(), self.lines, cache=self.cache)
+        # only the queue is mutable, everything else (including the placement caches, which are keyed
+        # by piece and only depend on the board) is shared with this state
+        return TetrisStateSpace._trusted(self.rows, self.queue.copy(), self.lines, self.cache,
+                                         self._heights, self._column_holes, self._board_hash,
+                                         self.cached_grids, self.cached_placements, self._features, self.placement)
     
     def is_terminal(self):
         """
@@ -213,32 +481,93 @@ class TetrisStateSpace:
         """
         return len(self.legal_placements()) == 0
     
-    def legal_placements(self):
+    def legal_placements(self, dedupe=False):
         """
         Returns a list of legal placements in (col, orientation) format.
+        With dedupe, placements that leave the same board as an earlier one are left out (see unique_placements).
         """
-        if self.cache and self.cached_placements is not None:
-            return self.cached_placements
+        if dedupe:
+            return self.unique_placements()
+
+        piece = self.queue[0]
+
+        if self.cache:
+            if piece in self.cached_placements:
+                return self.cached_placements[piece]
+
+            shared = shared_placement_cache
+
+            if shared is not None:
+                # another state with this exact board may already have worked this piece out
+                entry = shared.lookup(self.board_hash, piece)
+
+                if entry is not None:
+                    self.cached_grids[piece], self.cached_placements[piece] = entry
+                    return entry[1]
 
         placements = []
 
+        for orientation, table in PIECE_TABLES[piece].items():
+            for col in range(self.COLUMNS - table.width + 1):
+                if self._landing_row(piece, col, orientation) is not None:
+                    placements.append((col, orientation))
+
+        if self.cache:
+            self.cached_placements[piece] = placements
+
+            if shared is not None:
+                shared.store(self.board_hash, piece, (self.cached_grids[piece], placements))
+
+        return placements
+
+    def unique_placements(self):
+        """
+        legal_placements, keeping only the first of the placements that leave exactly the same board behind.
+        SHAPES only lists distinct orientations, so no two placements ever fill the same cells, and a placement
+        that clears no rows leaves a board nothing else can. Two placements that clear the very same rows would
+        have to fill the same cells too, so a collision needs placements that complete different rows: boards
+        with fewer than two rows the piece could complete keep every placement without looking further, and
+        otherwise only the placements that complete a row are placed to compare their boards.
+        """
         piece = self.queue[0]
-        orientations = SHAPES[piece]
+        # the unique placements are cached next to the full lists, they only depend on the board as well
+        key = (piece, "unique")
+
+        if self.cache and key in self.cached_placements:
+            return self.cached_placements[key]
+
+        placements = self.legal_placements()
+        rows = self.rows
+        # a piece has four cells, so it can only complete rows with at most four gaps
+        completable = [r for r, mask in enumerate(rows) if ROW_GAPS[mask] <= 4]
+        unique = placements
+
+        if len(completable) >= 2:
+            unique = []
+            seen = set()
+
+            for (col, orientation) in placements:
+                row = self._landing_row(piece, col, orientation)
+                table = PIECE_TABLES[piece][orientation]
 
-        for orientation, grid in orientations.items():
-            grid_width = len(grid[0])
+                if row <= completable[-1] and row + table.height > completable[0] and any(
+                        rows[row + i] | mask == self.FULL_ROW for i, mask in table.column_masks[col]):
+                    new_rows = self._place(piece, col, orientation, row)[0]
 
-            for col in range(self.COLUMNS - grid_width + 1):
-                cells = self._drop_location(piece, col, orientation)
+                    if new_rows in seen:
+                        continue
 
-                if cells is not None:
-                    key = (col, orientation)
-                    placements.append(key)
+                    seen.add(new_rows)
+
+                unique.append((col, orientation))
+
+            if len(unique) == len(placements):
+                unique = placements
 
         if self.cache:
-            self.cached_placements = placements
+            self.cached_placements[key] = unique
 
-        return placements
+        return unique
 
     def place_piece(self, y, o, p):
         """
@@ -248,40 +577,545 @@ class TetrisStateSpace:
         if p not in self.VALID_SHAPES:
             raise ValueError(f"invalid piece type '{p}'")
 
+        return self.afterstate(y, o).spawn(p)
+
+    def afterstate(self, y, o):
+        """
+        The deterministic half of place_piece: drops the current piece in the provided column and
+        orientation and clears any full rows, but does not draw the next piece yet. Every piece the
+        chance node could draw next leads to the same afterstate, so chance nodes build it once and
+        call spawn on it for each piece.
+        """
         piece = self.queue[0]
 
         if o not in SHAPES[piece]:
             raise ValueError(f"invalid orientation {o} for piece '{piece}'")
 
-        cells = self._drop_location(piece, y, o)
+        row = self._landing_row(piece, y, o)
 
-        if cells is None:
+        if row is None:
             raise ValueError("collision at final landing position")
 
-        new_board = copy.deepcopy(self.board)
-        new_queue = self.queue.copy()
-        new_lines = self.lines
+        new_rows, new_heights, new_holes, num_cleared, new_hash, features, placement = self._place(piece, y, o, row)
+
+        return Afterstate(new_rows, self.queue[1:], self.lines + num_cleared, num_cleared, new_heights, new_holes, new_hash,
+                          self.cache, features, placement)
+
+    def successor_batch(self, dedupe=False):
+        """
+        Generates every legal placement of the current piece in one pass and returns them packed together
+        in a SuccessorBatch: the moves, each child's rows, skyline and lines cleared, and where the piece
+        landed. No state objects are built; callers that want to keep a child ask the batch for it.
+        With dedupe, placements leaving the same board are generated once (see unique_placements).
+        """
+        piece = self.queue[0]
+        batch = SuccessorBatch(self.queue[1:], self.lines, self.cache)
+
+        for (col, orientation) in self.legal_placements(dedupe):
+            row = self._landing_row(piece, col, orientation)
+            batch.append((col, orientation), row, *self._place(piece, col, orientation, row))
+
+        return batch
+
+    def placement_features(self, piece):
+        """
+        The (lines cleared, aggregate height, holes, bumpiness) of the board every legal placement of piece
+        would leave, for a one-ply best response. piece doesn't have to be the next one in the queue, and no
+        states, rows or caches are built: the landing row and the new skyline come from the piece's precompiled
+        drop profile (the top and bottom offsets of its columns) and this board's skyline, exactly as _place
+        works them out. Only the placements that clear rows or slide in under an overhang go through _place,
+        and so do all of them on a board that already holds a full row (the constructors accept one), since
+        _place clears it whatever the piece does.
+        """
+        ROWS = self.ROWS
+        rows = self.rows
+        heights = self.heights
+        aggregate_height, holes, bumpiness = self.features
+        # a piece has four cells, so it can only complete rows with at most four gaps
+        lowest = next((r for r, mask in enumerate(rows) if ROW_GAPS[mask] <= 4), ROWS)
+        full = self.FULL_ROW in rows
+        results = []
+
+        for orientation, table in PIECE_TABLES[piece].items():
+            top = table.top
+            bottom = table.bottom
+            width = table.width
 
-        for (i, j) in cells:
-            new_board[i][j] = 1
+            for col in range(self.COLUMNS - width + 1):
+                row = ROWS - table.height
 
-        full_rows = [r for r in range(self.ROWS) if all(new_board[r][c] == 1 for c in range(self.COLUMNS))]
+                for j in range(width):
+                    height = heights[col + j]
 
-        if full_rows:
+                    if ROWS - height < top[j]:
+                        row = None
+                        break
+
+                    if ROWS - 1 - height - bottom[j] < row:
+                        row = ROWS - 1 - height - bottom[j]
+
+                if row is None:
+                    # the piece has to be slid down the rows under an overhang
+                    row = self._scan_drop_row(table, col)
+
+                    if row is None or row < 0:
+                        continue
+
+                    _, _, _, cleared, _, features, _ = self._place(piece, col, orientation, row)
+                    results.append((cleared,) + features)
+                    continue
+
+                if row < 0:
+                    continue
+
+                if full or (row + table.height > lowest and
+                            any(rows[row + i] | mask == self.FULL_ROW for i, mask in table.column_masks[col])):
+                    _, _, _, cleared, _, features, _ = self._place(piece, col, orientation, row)
+                    results.append((cleared,) + features)
+                    continue
+
+                # the piece rests on the skyline: its columns rise to its top and every cell between its
+                # bottom and the old column top becomes a hole
+                new_heights = list(heights)
+                new_aggregate_height = aggregate_height
+                new_holes = holes
+
+                for j in range(width):
+                    c = col + j
+                    new_heights[c] = ROWS - row - top[j]
+                    new_aggregate_height += new_heights[c] - heights[c]
+                    new_holes += ROWS - heights[c] - row - bottom[j] - 1
+
+                new_bumpiness = bumpiness
+                first = col - 1 if col > 0 else 0
+                last = col + width if col + width < self.COLUMNS else self.COLUMNS - 1
+
+                for c in range(first, last):
+                    new_bumpiness += abs(new_heights[c] - new_heights[c + 1]) - abs(heights[c] - heights[c + 1])
+
+                results.append((0, new_aggregate_height, new_holes, new_bumpiness))
+
+        return results
+
+    def placement_boards(self, piece):
+        """
+        The (rows, column heights, holes, (landing height, eroded cells)) of the board every legal placement of
+        piece would leave, for evaluators that need the rows. Like placement_features, piece doesn't have to be
+        the next one in the queue and no states are built.
+        """
+        results = []
+
+        for orientation, table in PIECE_TABLES[piece].items():
+            for col in range(self.COLUMNS - table.width + 1):
+                row = self._landing_row(piece, col, orientation)
+
+                if row is not None:
+                    new_rows, new_heights, _, _, _, features, placement = self._place(piece, col, orientation, row)
+                    results.append((new_rows, new_heights, features[1], placement))
+
+        return results
+
+    def _place(self, piece, y, o, row):
+        """
+        Writes the piece onto the board at its landing row and clears full rows. Returns the new rows,
+        column heights, column holes, number of rows cleared, board hash (None if this state's hash
+        was never computed), features and the (landing height, eroded piece cells) of the placement.
+        """
+        table = PIECE_TABLES[piece][o]
+        rows = self.rows
+        old_heights = self.heights
+        old_holes = self.column_holes
+        new_heights = list(old_heights)
+        new_holes = list(old_holes)
+
+        # only the rows the piece lands in are rebuilt, the rest are shared with this state
+        new_rows = rows[:row] + tuple(rows[row + i] | mask for i, mask in table.column_masks[y]) + rows[row + table.height:]
+        new_hash = self._board_hash
+
+        if new_hash is not None:
+            for r in range(row, row + table.height):
+                keys = ROW_ZOBRIST_KEYS[r]
+                new_hash ^= keys[rows[r]] ^ keys[new_rows[r]]
+
+        for j in range(table.width):
+            c = y + j
+
+            if row + table.bottom[j] < self.ROWS - new_heights[c]:
+                # the piece rests on the skyline, so every cell between its bottom and the old column top is a new hole
+                new_holes[c] += self.ROWS - new_heights[c] - row - table.bottom[j] - 1
+                new_heights[c] = self.ROWS - row - table.top[j]
+            else:
+                # the piece spawned underneath this column's top block, so rescan it
+                new_heights[c], new_holes[c] = self._scan_column(new_rows, c)
+
+        # update the parent's features from the touched columns: their own heights and holes, and the
+        # bumpiness of the column pairs on either side of them
+        aggregate_height, holes, bumpiness = self.features
+        first = y - 1 if y > 0 else 0
+        last = y + table.width if y + table.width < self.COLUMNS else self.COLUMNS - 1
+
+        for c in range(y, y + table.width):
+            aggregate_height += new_heights[c] - old_heights[c]
+            holes += new_holes[c] - old_holes[c]
+
+        for c in range(first, last):
+            bumpiness += abs(new_heights[c] - new_heights[c + 1]) - abs(old_heights[c] - old_heights[c + 1])
+
+        # the landing height is taken at the middle of the piece, measured from the floor
+        landing_height = self.ROWS - row - (table.height - 1) / 2
+        num_cleared = 0
+
+        if self.FULL_ROW in new_rows:
+            full_rows = {r for r, mask in enumerate(new_rows) if mask == self.FULL_ROW}
             num_cleared = len(full_rows)
-            new_lines += num_cleared
+            # eroded piece cells: rows cleared times the piece's own cells that were cleared with them
+            eroded_cells = num_cleared * sum(bin(mask).count("1") for i, mask in table.column_masks[y] if row + i in full_rows)
+            new_rows = (0,) * num_cleared + tuple(mask for mask in new_rows if mask != self.FULL_ROW)
 
-            for r in sorted(full_rows, reverse=True):
-                del new_board[r]
+            if new_hash is not None:
+                # every row moved, so the hash has to be rebuilt
+                new_hash = 0
 
-            for _ in range(num_cleared):
-                new_board.insert(0, [0]*self.COLUMNS)
+                for keys, mask in zip(ROW_ZOBRIST_KEYS, new_rows):
+                    new_hash ^= keys[mask]
 
-        new_queue[0] = new_queue[1]
-        new_queue[1] = new_queue[2]
-        new_queue[2] = p
+            for c in range(self.COLUMNS):
+                if self.ROWS - new_heights[c] in full_rows:
+                    # the column's top block was cleared, so its new top has to be found again
+                    new_heights[c], new_holes[c] = self._scan_column(new_rows, c)
+                else:
+                    # cleared rows are full, so they never held a hole of this column
+                    new_heights[c] -= num_cleared
 
-        return TetrisStateSpace(new_board, new_queue, new_lines)
-    
+            # a clear moves every column, so the features are summed again over the new skyline
+            return (new_rows, tuple(new_heights), tuple(new_holes), num_cleared, new_hash, skyline_features(new_heights, new_holes),
+                    (landing_height, eroded_cells))
 
-    
+        return (new_rows, tuple(new_heights), tuple(new_holes), num_cleared, new_hash, (aggregate_height, holes, bumpiness),
+                (landing_height, 0))
+
+
+class Afterstate:
+    """
+    The board right after a placement and its line clears, before the next random piece is known.
+    It holds the two queue pieces that were already known, and spawn(p) turns it into the full
+    TetrisStateSpace whose queue ends in p. All the spawned states share this afterstate's board,
+    skyline, hash and placement caches, so only the queue is built per piece.
+
+    Like a state, it exposes `board`, `lines`, `features` and `placement`, so the agents' evaluation
+    functions can score it directly: the evaluation never looks at the queue.
+    """
+
+    def __init__(self, rows, queue, lines, cleared, heights, column_holes, board_hash=None, cache=True, features=None,
+                 placement=None):
+        self.rows = rows
+        self.queue = queue
+        self.lines = lines
+        self.cleared = cleared
+        self.heights = heights
+        self.column_holes = column_holes
+        self.cache = cache
+        self.cached_grids = {}
+        self.cached_placements = {}
+        self._board_hash = board_hash
+        self._board = None
+        self._features = features
+        self.placement = placement
+
+    @property
+    def board(self):
+        if self._board is None:
+            self._board = [ROW_CELLS[mask] for mask in self.rows]
+
+        return self._board
+
+    @property
+    def holes(self):
+        return sum(self.column_holes)
+
+    @property
+    def features(self):
+        if self._features is None:
+            self._features = skyline_features(self.heights, self.column_holes)
+
+        return self._features
+
+    def requeue(self, queue):
+        """
+        The same afterstate with a different pair of known pieces, sharing this one's board and caches
+        """
+        afterstate = Afterstate(self.rows, queue, self.lines, self.cleared, self.heights, self.column_holes,
+                                self._board_hash, self.cache, self._features, self.placement)
+        afterstate.cached_grids = self.cached_grids
+        afterstate.cached_placements = self.cached_placements
+
+        return afterstate
+
+    def spawn(self, p):
+        """
+        Returns the state reached when p is drawn as the next piece
+        """
+        return TetrisStateSpace._trusted(self.rows, self.queue + [p], self.lines, self.cache,
+                                         self.heights, self.column_holes, self._board_hash,
+                                         self.cached_grids, self.cached_placements, self._features, self.placement)
+
+
+class SuccessorBatch:
+    """
+    Every child of one state, packed into flat arrays instead of one object per child. Child i's rows are
+    rows[i * ROWS:(i + 1) * ROWS] (packed row masks, like TetrisStateSpace.rows), its heights and holes are
+    heights/column_holes[i * COLUMNS:(i + 1) * COLUMNS], its features are aggregate_heights[i], holes[i] and
+    bumpiness[i], and moves[i], landing_rows[i], cleared[i] and placements[i] say which placement produced it, the
+    row the top of the piece's grid landed in, how many lines it cleared and its (landing height, eroded cells). With NumPy installed the same data can be viewed as (N, 20) / (N, 20, 10) / (N, 10) arrays
+    so a batch evaluator can score every child in one call.
+    """
+
+    def __init__(self, queue, lines, cache=True):
+        self.queue = queue
+        self.lines = lines
+        self.cache = cache
+        self.moves = []
+        self.landing_rows = array("b")
+        self.cleared = array("B")
+        self.rows = array("H")
+        self.heights = array("B")
+        self.column_holes = array("B")
+        self.hashes = []
+        self.aggregate_heights = array("H")
+        self.holes = array("H")
+        self.bumpiness = array("H")
+        self.placements = []
+
+    def append(self, move, landing_row, rows, heights, column_holes, cleared, board_hash, features, placement):
+        self.moves.append(move)
+        self.landing_rows.append(landing_row)
+        self.cleared.append(cleared)
+        self.rows.extend(rows)
+        self.heights.extend(heights)
+        self.column_holes.extend(column_holes)
+        self.hashes.append(board_hash)
+        self.aggregate_heights.append(features[0])
+        self.holes.append(features[1])
+        self.bumpiness.append(features[2])
+        self.placements.append(placement)
+
+    def __len__(self):
+        return len(self.moves)
+
+    def child_rows(self, i):
+        return tuple(self.rows[i * TetrisStateSpace.ROWS:(i + 1) * TetrisStateSpace.ROWS])
+
+    def afterstate(self, i):
+        """
+        Builds the Afterstate of child i, e.g. for the children a search decides to expand further
+        """
+        columns = slice(i * TetrisStateSpace.COLUMNS, (i + 1) * TetrisStateSpace.COLUMNS)
+        cleared = self.cleared[i]
+
+        return Afterstate(self.child_rows(i), self.queue, self.lines + cleared, cleared,
+                          tuple(self.heights[columns]), tuple(self.column_holes[columns]), self.hashes[i], self.cache,
+                          (self.aggregate_heights[i], self.holes[i], self.bumpiness[i]), self.placements[i])
+
+    def rows_array(self):
+        """
+        The children's packed rows as an (N, 20) uint16 NumPy array
+        """
+        np = _numpy()
+        return np.frombuffer(self.rows, dtype=np.uint16).reshape(len(self), TetrisStateSpace.ROWS)
+
+    def cells_array(self):
+        """
+        The children's boards as an (N, 20, 10) uint8 NumPy array of 0/1 cells
+        """
+        np = _numpy()
+        return ((self.rows_array()[:, :, None] >> np.arange(TetrisStateSpace.COLUMNS, dtype=np.uint16)) & 1).astype(np.uint8)
+
+    def heights_array(self):
+        """
+        The children's column heights as an (N, 10) uint8 NumPy array
+        """
+        np = _numpy()
+        return np.frombuffer(self.heights, dtype=np.uint8).reshape(len(self), TetrisStateSpace.COLUMNS)
+
+
+def _numpy():
+    """
+    NumPy is optional: only the array views need it, the engine itself runs on the standard library.
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("NumPy is required for array views of successor batches (pip install numpy)") from None
+
+    return numpy
+
+
+def skyline_features(heights, column_holes):
+    """
+    Sums a skyline into the (aggregate height, holes, bumpiness) features from scratch
+    """
+    bumpiness = 0
+
+    for c in range(len(heights) - 1):
+        bumpiness += abs(heights[c] - heights[c + 1])
+
+    return sum(heights), sum(column_holes), bumpiness
+
+
+class PlacementCache:
+    """
+    A process-wide, bounded cache of placement work keyed by (board hash, piece). The per-state caches
+    die with their state, but sibling and transposed states, and the low-stack boards headless runs keep
+    coming back to, have identical boards; with this cache only the first of them computes the landing
+    rows and legal placements of a piece, and every later one gets references to the same dict and list.
+
+    The least recently used entry is evicted once `max_entries` is reached. An entry (up to 34 landing
+    rows and placements plus the key) takes roughly ENTRY_BYTES of memory, which is how `memory_cap_mb`
+    is turned into an entry count.
+    """
+    ENTRY_BYTES = 4096
+
+    def __init__(self, max_entries=100000, memory_cap_mb=None):
+        if memory_cap_mb is not None:
+            max_entries = int(memory_cap_mb * 1024 * 1024) // self.ENTRY_BYTES
+
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, board_hash, piece):
+        """
+        Returns the (landing rows, legal placements) of piece on the board, or None if not cached
+        """
+        key = (board_hash, piece)
+        entry = self.entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+
+        return entry
+
+    def store(self, board_hash, piece, entry):
+        if self.max_entries <= 0:
+            return
+
+        key = (board_hash, piece)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        """
+        Returns the hit/miss statistics of this cache as a dict
+        """
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate()
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+"""
+The shared placement cache consulted by legal_placements, off (None) unless enabled below.
+"""
+shared_placement_cache = None
+
+
+def enable_shared_placement_cache(max_entries=100000, memory_cap_mb=None):
+    """
+    Turns on the process-wide placement cache for every state with caching enabled and returns it
+    """
+    global shared_placement_cache
+    shared_placement_cache = PlacementCache(max_entries, memory_cap_mb)
+    return shared_placement_cache
+
+
+def disable_shared_placement_cache():
+    global shared_placement_cache
+    shared_placement_cache = None
+
+
+class PieceOrientation:
+    """
+    Everything the engine needs to know about one orientation of one piece, precompiled once from its
+    SHAPES grid so that successor generation never has to walk the nested lists again:
+        cells          (row, col) offsets of the filled tiles inside the grid
+        width, height  size of the grid
+        top, bottom    per grid column, the offset of its highest and lowest filled tile
+        masks          per grid row, the bit mask of its filled tiles aligned to column 0
+        column_masks   per legal board column, the (grid row, mask) pairs shifted into that column
+        column_cells   per legal board column, the (grid row, board col) of every filled tile
+    """
+
+    def __init__(self, grid, columns):
+        self.grid = grid
+        self.height = len(grid)
+        self.width = len(grid[0])
+        self.cells = tuple((i, j) for i in range(self.height) for j in range(self.width) if grid[i][j] == 1)
+        self.top = tuple(min(i for (i, j) in self.cells if j == col) for col in range(self.width))
+        self.bottom = tuple(max(i for (i, j) in self.cells if j == col) for col in range(self.width))
+        self.masks = tuple(sum(1 << j for j in range(self.width) if grid[i][j] == 1) for i in range(self.height))
+
+        legal_columns = range(columns - self.width + 1)
+        self.column_masks = tuple(tuple((i, mask << col) for i, mask in enumerate(self.masks)) for col in legal_columns)
+        self.column_cells = tuple(tuple((i, col + j) for (i, j) in self.cells) for col in legal_columns)
+
+
+"""
+Every piece letter of VALID_SHAPES, sorted so that anything drawn or keyed by piece doesn't depend on set
+iteration order, which changes between processes.
+"""
+PIECES = tuple(sorted(TetrisStateSpace.VALID_SHAPES))
+
+"""
+Interned cells of every possible 10-bit row, shared by the board views of all states.
+"""
+ROW_CELLS = tuple(tuple((mask >> c) & 1 for c in range(TetrisStateSpace.COLUMNS)) for mask in range(TetrisStateSpace.FULL_ROW + 1))
+
+"""
+Number of empty cells of every possible 10-bit row.
+"""
+ROW_GAPS = tuple(TetrisStateSpace.COLUMNS - bin(mask).count("1") for mask in range(TetrisStateSpace.FULL_ROW + 1))
+
+"""
+Precompiled tables for every piece and orientation in SHAPES, built once at import.
+"""
+PIECE_TABLES = {
+    piece: {orientation: PieceOrientation(grid, TetrisStateSpace.COLUMNS) for orientation, grid in orientations.items()}
+    for piece, orientations in SHAPES.items()
+}
+
+"""
+Zobrist keys, drawn once from a fixed seed so hashes agree between runs and between processes.
+The key of an empty row is 0 so empty rows do not need to be visited when hashing a board.
+"""
+_zobrist_random = random.Random(20240607)
+ROW_ZOBRIST_KEYS = tuple(
+    tuple(0 if mask == 0 else _zobrist_random.getrandbits(64) for mask in range(TetrisStateSpace.FULL_ROW + 1))
+    for _ in range(TetrisStateSpace.ROWS)
+)
+QUEUE_ZOBRIST_KEYS = tuple(
+    {piece: _zobrist_random.getrandbits(64) for piece in PIECES}
+    for _ in range(3)
+)
@@ -10,6 +10,8 @@
 from gameSimulator import TetrisApp
 from beamPrunedExpectimaxAgent import beamPrunedExpectimaxAgent
 from beamsearchChanceAgent import beamsearchChanceAgent  
+from lockstepSimulator import LockstepGames
+import TetrisStateSpace
 
 #NUM_RUNS = 3         
 #MAX_PIECES = 20
@@ -30,6 +32,11 @@ def run_agent_tests(agent_class, agent_name, numRuns, maxPieces):
         results.append(metrics)
         print(f"Run {i+1}: lines={metrics['lines']} | pieces={metrics['pieces']} | time={metrics['time']:.3f}s")
 
+        # agents that search with a transposition table report how often it paid off
+        if hasattr(agent, "transpositions"):
+            stats = agent.transpositions.stats()
+            print(f"       transpositions: hits={stats['hits']} | misses={stats['misses']} | hit rate={stats['hit_rate']:.2%}")
+
     # averages
     avg_lines = sum(r["lines"] for r in results) / numRuns
     avg_ratio = sum(r["lines"] / r["pieces"] for r in results) / numRuns
@@ -37,10 +44,42 @@ def run_agent_tests(agent_class, agent_name, numRuns, maxPieces):
     print("\n----- SUMMARY -----")
     print(f"Avg Lines Cleared:      {avg_lines:.2f}")
     print(f"Avg Lines/Piece Ratio:  {avg_ratio:.4f}")
+
+    shared = TetrisStateSpace.shared_placement_cache
+    if shared is not None:
+        stats = shared.stats()
+        print(f"Placement Cache:        {stats['entries']} boards | hit rate={stats['hit_rate']:.2%}")
     print("-------------------\n")
 
 
+# plays numGames seeded games side by side (see lockstepSimulator): with agent_class None the one-ply greedy
+# policy of the evaluator, otherwise one agent_class(agent_name, **settings) plays every game
+def run_lockstep_tests(agent_class, agent_name, numGames, maxPieces, seed=0, evaluator="classic", depth=None, **settings):
+    print("\n============================")
+    print(f" Running lockstep games: {agent_name} ({numGames} games, {maxPieces} pieces played)")
+    print("============================")
+
+    agent = agent_class(agent_name, evaluator=evaluator, **settings) if agent_class is not None else None
+    results = LockstepGames(numGames, seed, evaluator, agent=agent, depth=depth).run(maxPieces)
+
+    avg_lines = sum(r["lines"] for r in results) / numGames
+    avg_ratio = sum(r["lines"] / r["pieces"] for r in results if r["pieces"]) / numGames
+    total_pieces = sum(r["pieces"] for r in results)
+    total_time = max(r["time"] for r in results)
+
+    print("\n----- SUMMARY -----")
+    print(f"Avg Lines Cleared:      {avg_lines:.2f}")
+    print(f"Avg Lines/Piece Ratio:  {avg_ratio:.4f}")
+    print(f"Throughput:             {total_pieces / total_time:.0f} pieces/s" if total_time > 0 else "Throughput:             n/a")
+    print("-------------------\n")
+
+    return results
+
+
 if __name__ == "__main__":
+    # consecutive runs keep revisiting the same low-stack boards, so share placements between all of them
+    TetrisStateSpace.enable_shared_placement_cache(memory_cap_mb=256)
+
     run_agent_tests(beamPrunedExpectimaxAgent, "Beam Pruned Expectimax", 3, 10)
     run_agent_tests(beamsearchChanceAgent, "3-Ply BeamSearch with Chance Layer", 3, 10)
 
@@ -2,6 +2,7 @@ from TetrisStateSpace import TetrisStateSpace
 from expectimaxAgent import expectimaxAgent 
 from src.beamsearchChanceAgent import beamsearchChanceAgent
 from beamPrunedExpectimaxAgent import beamPrunedExpectimaxAgent
+from pieceSource import UniformPieces
 
 import sys
 
@@ -216,6 +217,89 @@ def hole_avoidance(agentType):
         else: 
             print("FAIL: Agent buried the hole, which is not optimal for future plays.")
 
+# the subtree store only hands back afterstates a search already built, so searching with it on and off
+# has to give every root move exactly the same value, move after move of a game
+def test_subtree_store_consistency(agentType, depth, moves=3):
+    print("\n === Subtree Store TEST 5: ===")
+    print(f"goal: depth {depth} root values must be identical with the subtree store on and off")
+
+    if agentType == "expectimax":
+        agents = [expectimaxAgent("TreeOn"), expectimaxAgent("TreeOff", tree_memory_mb=0)]
+    elif agentType == "beamPrunedExpectimaxAgent":
+        agents = [beamPrunedExpectimaxAgent("TreeOn"), beamPrunedExpectimaxAgent("TreeOff", tree_memory_mb=0)]
+    else:
+        print("SKIPPED: this agent doesn't keep a subtree store.")
+        return
+
+    pieces = UniformPieces(3)
+    state = TetrisStateSpace([[0] * 10 for _ in range(20)], [pieces.next_piece() for _ in range(3)], lines=0)
+
+    for move in range(moves):
+        possibleMoves = state.legal_placements()
+        values = []
+
+        for agent in agents:
+            root = agent.tree.begin(state) if agent.tree is not None else state
+            values.append([agent.rootValue(root, depth, m) for m in possibleMoves])
+
+        treeValues, plainValues = values
+        bestMove = possibleMoves[max(range(len(plainValues)), key=plainValues.__getitem__)]
+
+        if treeValues != plainValues:
+            worst = max(abs(a - b) for a, b in zip(treeValues, plainValues))
+            print(f"FAILURE: move {move + 1}: root values differ by up to {worst} with the subtree store on.")
+            return
+
+        # the store keeps the chosen move's subtree for the next search, like getAction does
+        agents[0].tree.finish(bestMove)
+        state = state.place_piece(*bestMove, pieces.next_piece())
+
+    print(f"SUCCESS: identical root values on all {moves} moves.")
+
+# star1 only cuts off chance nodes that provably can't change the move, so it has to choose exactly the moves of
+# plain expectimax, move after move of a game, while expanding fewer nodes
+def test_star1_exactness(agentType, depth, moves=3):
+    print("\n === Star1 Pruning TEST 6: ===")
+    print(f"goal: depth {depth} star1 must choose the moves of plain expectimax with fewer nodes expanded")
+
+    if agentType != "expectimax":
+        print("SKIPPED: only expectimax has star1 pruning.")
+        return
+
+    plain = expectimaxAgent("Plain")
+    star1 = expectimaxAgent("Star1", pruning="star1")
+
+    # a ragged stack with a hole and an open well: on an empty board the statically best move is usually the
+    # right one, so even a broken bound that cuts everything after it would pass
+    custom_board = [[0] * 10 for _ in range(20)]
+    for c, height in enumerate([6, 2, 5, 1, 4, 6, 2, 3, 5, 0]):
+        for r in range(20 - height, 20):
+            custom_board[r][c] = 1
+    custom_board[18][2] = 0
+
+    pieces = UniformPieces(3)
+    state = TetrisStateSpace(custom_board, [pieces.next_piece() for _ in range(3)], lines=0)
+
+    for move in range(moves):
+        plainMove = plain.getAction(state, depth)
+        star1Move = star1.getAction(state, depth)
+
+        if plainMove != star1Move:
+            print(f"FAILURE: move {move + 1}: star1 chose {star1Move}, plain expectimax chose {plainMove}.")
+            return
+
+        if plainMove is None:
+            break
+
+        state = state.place_piece(*plainMove, pieces.next_piece())
+
+    print(f"nodes expanded: plain={plain.nodesExpanded} | star1={star1.nodesExpanded}")
+
+    if star1.nodesExpanded < plain.nodesExpanded:
+        print(f"SUCCESS: identical moves on all {moves} moves, {plain.nodesExpanded / star1.nodesExpanded:.1f}x fewer nodes.")
+    else:
+        print("FAILURE: star1 chose the same moves but didn't expand fewer nodes.")
+
 def run_all_tests(agentType: str):
     """
     Run all test scenarios for the given agent type.
@@ -236,6 +320,10 @@ def run_all_tests(agentType: str):
     test_survival_scenario(agentType)
     rotation_required(agentType)
     hole_avoidance(agentType)
+    # beam pruning keeps depth 8 affordable, full expectimax only gets to depth 3
+    test_subtree_store_consistency(agentType, 8 if agentType == "beamPrunedExpectimaxAgent" else 3)
+    test_star1_exactness(agentType, 2)
+    test_star1_exactness(agentType, 3)
 
 
 if __name__ == "__main__":
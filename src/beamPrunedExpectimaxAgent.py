@@ -1,125 +1,112 @@
 from TetrisStateSpace import TetrisStateSpace
+from transpositionTable import TranspositionTable
+from chanceSampling import ChanceSampler
+from searchAgent import SearchAgent
+import heapq
 import random
 import sys
 import traceback
 
 
-HEIGHT_WEIGHT = -0.51
-LINES_WEIGHT = 0.76
-HOLES_WEIGHT = -0.36
-BUMPINESS_WEIGHT = -0.18
+class beamPrunedExpectimaxAgent(SearchAgent):
+    DEFAULT_DEPTH = 2
 
-
-class beamPrunedExpectimaxAgent:
-    def __init__(self, agentName: str, beam_width = 2):
+    # pass a shared TranspositionTable to let several agents consult the same values,
+    # or TranspositionTable(max_entries=0) to search without one
+    # evaluator picks the heuristic from evaluation.EVALUATORS ("classic" or "dellacherie")
+    # workers > 0 searches the root moves of fixed depth searches in that many worker processes
+    # sampling=ChanceSampler(...) only searches a sample of the pieces at the deeper chance nodes
+    # the afterstates of the branch the game took are kept for the next move, in up to tree_memory_mb (0: off)
+    # dedupe=True only expands one of the placements that leave the same board, so the beam never holds both
+    def __init__(self, agentName: str, beam_width = 2, transposition_table: TranspositionTable = None,
+                 evaluator: str = "classic", workers: int = None, sampling: ChanceSampler = None,
+                 tree_memory_mb: float = 64, dedupe: bool = False):
         self.beam_width = beam_width
-        self.agentName = agentName
-
-    # This needed to be adjusted to simulate the next
-    def getAction(self, currGameState: TetrisStateSpace, depth: int = 2):
-        #loops over all potential moves and returns the one with the highest score
-        possibleMoves = currGameState.legal_placements()
-
-        if not possibleMoves:
-            return None
-
-        bestScore = -float("inf")
-        bestMove = None
-
-        for (col, orientation) in possibleMoves:
-            # but expectiMax now properly alternates max/chance and uses depth
-            score = self.expectiMax(currGameState, depth, (col, orientation), False)
-            ##print(score)
-            if score > bestScore:
-                bestScore = score
-                bestMove = (col, orientation)
-            
-        return bestMove
-    
+        super().__init__(agentName, ("beamPrunedExpectimax", beam_width, evaluator, dedupe), transposition_table,
+                         evaluator, workers, sampling, tree_memory_mb, dedupe)
+
+    # depth drops at both max and chance nodes, and a search ending on a chance node scores the same
+    # states as one level shallower, so only every other depth (same parity as depth) places a new piece
+    def deepeningDepths(self, depth: int):
+        return range(2 - depth % 2, depth + 1, 2)
+
+    def workerSettings(self):
+        return {**super().workerSettings(), "beam_width": self.beam_width}
 
     # the current gamestate actually has the piece that we are supposed to put down stored in the queue
     # the queue contains the next 3 pieces that will be placed by the player
     # should this be modified to actualy take those 3 next pieces?
-    def expectiMax(self, gameState: TetrisStateSpace, depth: int, action, isMaxAgent: bool):
+    # a chance node can be handed the afterstate of its action when the caller already built it
+    def expectiMax(self, gameState: TetrisStateSpace, depth: int, action, isMaxAgent: bool, afterstate=None):
+    # anytime mode: abandon this iteration once the deadline has passed
+        if self.deadline is not None:
+            self.deadline.check()
+
     # Base case: either game over or search depth exhausted
         if gameState.is_terminal() or depth <= 0:
             return self.evaluationFunction(gameState)
 
+        # positions reached through a different move order were already searched
         if isMaxAgent:
-            legal_moves = gameState.legal_placements()
+            key = TranspositionTable.max_key(gameState, depth, self.searchVariant, self.relevantPieces(depth, True),
+                                             self.keyPlacement)
+        else:
+            key = TranspositionTable.chance_key(gameState, depth, action, self.searchVariant, self.relevantPieces(depth, False))
+
+        cached = self.transpositions.lookup(key)
+        if cached is not None:
+            return cached
+
+        if isMaxAgent:
+            legal_moves = gameState.legal_placements(self.dedupe)
 
             if not legal_moves:
                 return self.evaluationFunction(gameState)
 
-            # Search one ahead
-            scored_moves = []
-
-            for (col, orientation) in legal_moves:
-                next_state = gameState.place_piece(col, orientation, "O")
-                h = self.evaluationFunction(next_state)
-                scored_moves.append((h, (col, orientation)))
+            # Search one ahead, scoring every child in one batch
+            successors = gameState.successor_batch(self.dedupe)
+            scores = self.evaluateSuccessors(successors)
 
-            # Keep only top self.beam_width moves
-            scored_moves.sort(key=lambda x: x[0], reverse=True)
-            pruned_moves = [move for (_, move) in scored_moves[:self.beam_width]]
+            # Keep only top self.beam_width moves (nlargest keeps ties in move order, like a stable sort)
+            pruned = heapq.nlargest(self.beam_width, range(len(scores)), key=scores.__getitem__)
 
             maxScore = -float("inf")
-            for (col, orientation) in pruned_moves:
+            for i in pruned:
                 # Next layer is a chance node, depth decreases
-                score = self.expectiMax(gameState, depth - 1, (col, orientation), isMaxAgent=False)
+                # the kept child's afterstate comes straight out of the batch instead of being placed again
+                score = self.expectiMax(gameState, depth - 1, successors.moves[i], isMaxAgent=False,
+                                        afterstate=self.buildAfterstate(gameState, successors.moves[i],
+                                                                        lambda: successors.afterstate(i)))
                 maxScore = max(maxScore, score)
 
+            self.transpositions.store(key, maxScore)
             return maxScore
         else:
             col, orientation = action
             expectedScore = 0.0
             num_pieces = len(gameState.VALID_SHAPES)
 
-            for piece in gameState.VALID_SHAPES:
-                newState = gameState.place_piece(col, orientation, piece)
-                # Next layer is a max node, depth also decreases here
-                score = self.expectiMax(newState, depth - 1, None, isMaxAgent=True)
-                expectedScore += score / num_pieces
-
+            # the placement itself doesn't depend on the random piece, so it is only done once
+            if afterstate is None:
+                afterstate = self.buildAfterstate(gameState, action, lambda: gameState.afterstate(col, orientation))
+
+            if self.sampling is not None and self.sampling.samples((self.searchRootDepth - depth) // 2 + 1):
+                # deep chance nodes only search as many pieces as it takes to pin the average down
+                expectedScore = self.sampling.expected_value(
+                    lambda piece: self.expectiMax(afterstate.spawn(piece), depth - 1, None, isMaxAgent=True),
+                    (gameState.zobrist, action, depth))
+            else:
+                for piece in gameState.VALID_SHAPES:
+                    newState = afterstate.spawn(piece)
+                    # Next layer is a max node, depth also decreases here
+                    score = self.expectiMax(newState, depth - 1, None, isMaxAgent=True)
+                    expectedScore += score / num_pieces
+
+        self.transpositions.store(key, expectedScore)
         return expectedScore
 
-    
-    # Referencing Pierre Dellacherie's Algorithm
-    # modify this to also make this take the queue's "fit" to the board
-    def evaluationFunction(self, currGameState: TetrisStateSpace):
-        board = currGameState.board
-        rows = len(board)
-        cols = len(board[0])
-
-        aggregateHeight = 0
-        columnHeights = [0] * cols
-        holes = 0
-
-        for c in range(cols):
-            blockFound = False
-
-            for r in range(rows):
-                if board[r][c] == 1:
-                    if not blockFound:
-                        h = rows - r
-                        columnHeights[c] = h
-                        aggregateHeight += h
-                        blockFound = True
-                elif blockFound and board[r][c] == 0:
-                    holes += 1
-
-        bumpiness = 0
-
-        #sum of absolute difference between adjacent column height
-        for c in range(cols - 1):
-            bumpiness += abs(columnHeights[c] - columnHeights[c+1])
-
-        score = (
-            HEIGHT_WEIGHT * aggregateHeight
-            + HOLES_WEIGHT * holes
-            + BUMPINESS_WEIGHT * bumpiness
-            + LINES_WEIGHT * currGameState.lines
-        )
-
-        return score
-
+    # how many queue pieces the search below a node can see: pieces further back never get placed before
+    # the horizon, so states that only differ there have the same value and can share a table entry
+    def relevantPieces(self, depth: int, isMaxAgent: bool):
+        # depth drops at both max and chance nodes here, so only every other level places a piece
+        return min((depth + 1) // 2 if isMaxAgent else depth // 2 + 1, 3)
@@ -1,20 +1,16 @@
 from TetrisStateSpace import TetrisStateSpace
 from operator import itemgetter
-
-# punish height increases because they reduce available space and increase risk of topping out
-HEIGHT_WEIGHT = -0.51
-# reward number of lines cleared 
-LINES_WEIGHT = 0.76
-# punish hole creation because they make it impossible to clear lines for the blocks around them
-HOLES_WEIGHT = -0.36
-# punish bumpiness to prioritize moves that lead to a flatter board space 
-BUMPINESS_WEIGHT = -0.18
+from evaluation import get_evaluator, get_best_response
+from parallelSearch import PooledAgent
+from chanceSampling import ChanceSampler
 
 
 """
 Expectimax-Beam Search Hybrid Approach:
 Attempting to take advantage of Beam search and expectimax by simulating a deterministic beam search for queue[0], queue[1], and queue[2]
 and then implementing a chance layer for the unknown random piece that's going to be added to the queue after
+(with a smaller depth only the first one or two known pieces are beam searched, and the tail is the best placement of the next known piece,
+with a larger one every random piece but the last is placed by a beam layer of its own below the chance layer it's drawn in)
 
 Why Combine Beam Search with Expectimax:
 In expectimax, the number of state spaces that need to be evaluated explodes in size when trying to look more than 3 turns ahead. 
@@ -22,168 +18,199 @@ I created this agent with the intention of having the agent make more informed d
 are stored in the queue in the gamestate, however after devling deeper and discussing the model's weaknesses in modeling Tetris' stochastic nature with my teammates, 
 I realized it would be better to instead try investing more time into optimizing the expectimax agent.
 """
-class beamsearchChanceAgent:
+class beamsearchChanceAgent(PooledAgent):
+
+    # evaluator picks the heuristic from evaluation.EVALUATORS ("classic" or "dellacherie")
+    # workers > 0 works out the chance tails of the last layer's survivors in that many worker processes
+    # sampling=ChanceSampler(...) only searches a sample of the pieces in the chance layer
+    # dedupe=True only keeps one of the placements that leave the same board, and one survivor per board in each beam
+    # depth is how many pieces the beam places before the tail: up to 3 known queue pieces, past them the random
+    # ones drawn in the chance layers. beam_width is how many states survive each layer, max_per_root caps how
+    # many survivors of a layer may come from the same initial move (None: no cap)
+    def __init__(self, agentName: str, evaluator: str = "classic", workers: int = None, sampling: ChanceSampler = None,
+                 dedupe: bool = False, depth: int = 3, beam_width: int = 4, max_per_root: int = None):
+        if depth < 1:
+            raise ValueError("depth must be at least 1")
 
-    def __init__(self, agentName: str):
         self.agentName = agentName
-        self.beam_width = 4
+        self.depth = depth
+        self.beam_width = beam_width
+        self.max_per_root = max_per_root
+        self.evaluator = evaluator
+        self.evaluate, self.evaluateSuccessors = get_evaluator(evaluator)
+        self.bestScore = get_best_response(evaluator)
+        self.workers = workers
+        self.pool = None
+        self.sampling = sampling
+        self.dedupe = dedupe
 
     def getAction(self, currGameState: TetrisStateSpace):
-        # LAYER 1: piece at queue[0]
-        moves = currGameState.legal_placements()
-        if not moves: 
-            return None
-
-        candidates_layer1 = []
-        #place current piece in all possible legal placements and evaluate each successor state's expected value
-        for col, orient in moves:
-            # this "O" that's being placed is a dummy piece that we will never simulate
-            # the state_space function needs to receive the "next piece being added to the queue" but it's never taken into account for future predictions
-            next_state = currGameState.place_piece(col, orient, "O")
-            score = self.evaluationFunction(next_state)
-            candidates_layer1.append((score, (col, orient), next_state))
+        # the root is the only state of the first beam, it has no initial move yet
+        beam = [(None, None, currGameState)]
 
-        #print("Candidate Layer 1:")
-        #for item in candidates_layer1:
-            #print(item[:2])
-        
-        # pruning to have the beam contain only the top 4 initial moves with the greatest evaluated expected scores 
-        beam = self.pruneStates(candidates_layer1)
-
-        # LAYER 2: piece at queue[1] 
-        candidates_layer2 = []
-
-        # go through each successor state from layer 1 simulate placing the next piece 
-        # in the queue in all possible legal placements and evaluate each of those successor state's expected value
-        # length of candidate_layer2 = 4 * number of legal placements of moves per state
-        for _, initial_move, state_q1 in beam:
-           moves_q1 = state_q1.legal_placements()
-           if not moves_q1: continue
-           for col, orient in moves_q1:
-                # this "O" that's being placed is a dummy piece that we will never simulate
-                # the state_space function needs to receive the "next piece being added to the queue" but it's never taken into account for future predictions
-                state_q2 = state_q1.place_piece(col, orient, "O")
-                score = self.evaluationFunction(state_q2)
-                candidates_layer2.append((score, initial_move, state_q2))
+        # LAYERS 1 .. min(depth, 3) - 1: the pieces at queue[0], queue[1], ...
+        # place the layer's piece in all possible legal placements on every survivor of the previous layer, evaluate
+        # each successor state and keep the top beam_width of them, remembering which initial move they came from
+        for _ in range(min(self.depth, 3) - 1):
+            candidates = self.expandLayer(beam)
 
-        # fallback
-        if not candidates_layer2:
-            return beam[0][1] if beam else None
+            # fallback (no legal move at the root returns None)
+            if not candidates:
+                return beam[0][1]
 
-        #print("Candidate Layer 2:")
-        #for item in candidates_layer2:
-            #print(item[:2])
-        
-        # pruning to have the beam contain only the top 4 initial moves with the greatest evaluated expected scores
-        # after simulating placement of queue[1]
-        beam_layer2 = self.pruneStates(candidates_layer2)
+            beam = self.expandSurvivors(self.pruneStates(candidates))
+
+        # LAST KNOWN LAYER: the piece at queue[min(depth, 3) - 1]
+        # every placement of it on a survivor is scored by the tail that follows it instead of the heuristic
+        # the survivors are independent, so with workers each one is handled in a worker process
+        survivors = [state for _, _, state in beam]
+        if self.workers:
+            survivor_values = self.rootPool().map_states("chanceValues", survivors)
+        else:
+            survivor_values = [self.chanceValues(state) for state in survivors]
 
-        # LAYER 3: piece at queue[2]
-        candidates_layer3 = []
+        candidates_last = []
+        for (_, initial_move, state), values in zip(beam, survivor_values):
+            for move, expected_value in zip(state.legal_placements(self.dedupe), values):
+                candidates_last.append((expected_value, initial_move if initial_move is not None else move))
 
-        # go through each survivor of layer 2 and generate successor state for legal moves to place piece at queue[2]
-        for _, initial_move, state_q2 in beam_layer2:
-            moves_q2 = state_q2.legal_placements()
-            if not moves_q2: continue
+        if not candidates_last:
+            return beam[0][1]
 
-            for col, orient in moves_q2:
-                # edge of the known universe 
+        # the first of the best candidates, in the order they were generated
+        best_candidate = max(candidates_last, key=itemgetter(0))
+
+        # return the move associated with the best score
+        return best_candidate[1]
+
+    # scores every child of every survivor in one batch per survivor, as (score, initial move, (batch, index)) candidates
+    def expandLayer(self, beam):
+        candidates = []
+        for _, initial_move, state in beam:
+            if self.dedupe:
+                # the children's hashes are only worked out incrementally when their parent's is known
+                state.board_hash
+
+            successors = state.successor_batch(self.dedupe)
+            for i, score in enumerate(self.evaluateSuccessors(successors) if len(successors) else ()):
+                candidates.append((score, initial_move if initial_move is not None else successors.moves[i], (successors, i)))
+        return candidates
+
+    # expected values of every legal placement of the last known layer's piece on a survivor, in legal_placements order
+    def chanceValues(self, state: TetrisStateSpace):
+        values = []
+        for col, orient in state.legal_placements(self.dedupe):
+            if self.depth < 3:
                 # this "O" that's being placed is a dummy piece that we will never simulate
                 # the state_space function needs to receive the "next piece being added to the queue" but it's never taken into account for future predictions
-                state_q3 = state_q2.place_piece(col, orient, "O")
-                
+                next_state = state.place_piece(col, orient, "O")
+
+                # the next piece is still a known one, so the tail is just the best way to place it
+                values.append(self.bestResponse(next_state, next_state.queue[0]))
+            else:
+                # edge of the known universe
                 # CHANCE LAYER Expectimax Tail
-                # now we account for the unknown random piece spawning after placing the last known piece down 
-                expected_value = self.runChanceLayer(state_q3)
-                candidates_layer3.append((expected_value, initial_move, state_q3))
-            
-        if not candidates_layer3:
-            return beam_layer2[0][1] if beam_layer2 else None
+                # now we account for the unknown random piece spawning after placing the last known piece down
+                # (and with depth > 3 for the ones after it, one chance layer per piece)
+                values.append(self.runChanceLayer(state.afterstate(col, orient), self.depth - 2, 3))
+        return values
 
-        # sort Layer 3 results to find best initial action with highest expected value 
-        best_candidate = self.pruneStates(candidates_layer3)[0]
+    # the worker processes of the parallel last known layer work out the same tails as this agent
+    def workerSettings(self):
+        return {"agentName": self.agentName, "evaluator": self.evaluator, "sampling": self.sampling,
+                "dedupe": self.dedupe, "depth": self.depth, "beam_width": self.beam_width,
+                "max_per_root": self.max_per_root}
 
-        # return the move associated with the best score
-        return best_candidate[1]
-    
     # it finds the average case scenario of the current given board state if a random piece were to be played onto it
-    def runChanceLayer(self, state: TetrisStateSpace):
+    def runChanceLayer(self, afterstate, plies: int = 1, placed: int = 3):
         """
         simulates the Agent playing optimally against every possible random piece
-        that could spawn.
+        that could spawn, `plies` random pieces deep (`placed` pieces were placed above this layer).
         """
+        # this "O" that's being drawn is a dummy piece that we will never simulate, like the ones the beam spawns
+        state = afterstate.spawn("O")
+
+        # the chance layer draws the piece after `placed` pieces (the three known ones, and any random ones) have been placed
+        if self.sampling is not None and self.sampling.samples(placed):
+            return self.sampling.expected_value(lambda piece: self.pieceValue(afterstate, state, piece, plies, placed),
+                                                state.zobrist)
+
         total_score = 0
         probability = 1.0 / 7.0
         valid_shapes = ["O", "I", "S", "Z", "L", "J", "T"]
         
         for piece in valid_shapes:
-            # 1. Create a hypothetical universe where 'piece' is next
-            temp_state = state.clone()
-            temp_state.queue[0] = piece 
-            
-            # 2. Find best move for this specific piece
-            # we can now use the standard helper since queue[0] is correct
-            moves = temp_state.legal_placements()
-            
-            if not moves:
-                # if a piece spawns and we can't place it -> Game Over
-                best_response = -float('inf')
-            else:
-                best_response = -float('inf')
-                for col, orient in moves:
-                    child_state = temp_state.place_piece(col, orient, "O")
-                    score = self.evaluationFunction(child_state)
-                    
-                    if score > best_response:
-                        best_response = score
-            
+            best_response = self.pieceValue(afterstate, state, piece, plies, placed)
             total_score += best_response * probability
 
         return total_score
 
+    # the value of 'piece' spawning on the chance layer's board: in the last chance layer the best score it can get,
+    # otherwise it goes through a beam layer of its own and the best survivor's next chance layer counts
+    def pieceValue(self, afterstate, state: TetrisStateSpace, piece, plies: int, placed: int):
+        if plies == 1:
+            return self.bestResponse(state, piece)
+
+        # the random piece takes the front of the dummy queue, so the layer places it
+        root = afterstate.requeue([piece] + afterstate.queue[1:]).spawn("O")
+        candidates = self.expandLayer([(None, None, root)])
+
+        # if a piece spawns and we can't place it -> Game Over (-inf)
+        if not candidates:
+            return -float("inf")
+
+        return max(self.runChanceLayer(successors.afterstate(i), plies - 1, placed + 1)
+                   for _, _, (successors, i) in self.pruneStates(candidates))
+
+    # the best score the agent can get if 'piece' spawns next on the given state
+    # if a piece spawns and we can't place it -> Game Over (-inf)
+    def bestResponse(self, state: TetrisStateSpace, piece):
+        # the evaluator's kernel scores every placement of this piece straight off the board, so no
+        # hypothetical state with 'piece' at queue[0] has to be cloned and no successors are built
+        # (duplicate boards can't change the best score, so dedupe doesn't matter here)
+        return self.bestScore(state, piece)
+
+    def expandSurvivors(self, beam):
+        """
+        turns the (batch, index) children that survived pruning into states that can be expanded further
+        """
+        expanded = []
+        for score, initial_move, (successors, i) in beam:
+            # this "O" that's being placed is a dummy piece that we will never simulate
+            # the state_space function needs to receive the "next piece being added to the queue" but it's never taken into account for future predictions
+            expanded.append((score, initial_move, successors.afterstate(i).spawn("O")))
+        return expanded
+
     def pruneStates(self, candidates):
         # Sort in-place by score (Highest first)
         candidates.sort(key=itemgetter(0), reverse=True)
-        return candidates[:self.beam_width]
+        if not self.dedupe and self.max_per_root is None:
+            return candidates[:self.beam_width]
+
+        # otherwise walk down the ranking, skipping boards that already survived (the same board reached by
+        # different moves) and initial moves that already have max_per_root survivors
+        survivors = []
+        seen = set()
+        per_root = {}
+        for candidate in candidates:
+            _, initial_move, (successors, i) = candidate
+            if self.dedupe:
+                if successors.hashes[i] in seen:
+                    continue
+                seen.add(successors.hashes[i])
+            if self.max_per_root is not None:
+                if per_root.get(initial_move, 0) >= self.max_per_root:
+                    continue
+                per_root[initial_move] = per_root.get(initial_move, 0) + 1
+            survivors.append(candidate)
+            if len(survivors) == self.beam_width:
+                break
+        return survivors
     
     # Referencing Pierre Dellacherie's Algorithm 
     # modify this to also make this take the queue's "fit" to the board 
     def evaluationFunction(self, currGameState: TetrisStateSpace):
-        board = currGameState.board
-        rows = len(board)
-        cols = len(board[0])
-
-        aggregateHeight = 0
-        columnHeights = [0] * cols
-        holes = 0
-
-        for c in range(cols):
-            blockFound = False
-
-            for r in range(rows):
-                if board[r][c] == 1:
-                    if not blockFound:
-                        h = rows - r
-                        columnHeights[c] = h
-                        aggregateHeight += h
-                        blockFound = True
-                elif blockFound and board[r][c] == 0:
-                    holes += 1
-
-        bumpiness = 0
-
-        #sum of absolute difference between adjacent column height
-        for c in range(cols - 1):
-            bumpiness += abs(columnHeights[c] - columnHeights[c+1])
-
-        score = (
-            HEIGHT_WEIGHT * aggregateHeight
-            + HOLES_WEIGHT * holes
-            + BUMPINESS_WEIGHT * bumpiness
-            + LINES_WEIGHT * currGameState.lines
-        )
-
-        return score
+        return self.evaluate(currGameState)
     
 
     
@@ -0,0 +1,281 @@
+"""
+Parallel, seeded benchmark runner.
+
+agentSimulator plays its configurations one game at a time with hard-coded run counts and unseeded pieces.
+This runs the whole matrix of agents x depths x beam widths x pieces given on the command line, with every
+game of it a separate task for a process pool:
+
+    python3 benchmark.py --agents beamPrunedExpectimax beamSearchChance --pieces 10 20 50 --runs 5
+    python3 benchmark.py --agents expectimax --depths 1 2 --pieces 100 --runs 20 --workers 8 --json out.json
+
+Run i of every configuration is played with the pieces of seed (--seed, i), so all the configurations
+are compared on the same piece sequences and rerunning the benchmark plays exactly the same games. The
+pieces are uniformly random by default, --source bag deals them with the 7-bag randomizer, and --sequence
+replays a recorded sequence file instead (see pieceSource), run i starting at piece i * (pieces + 3).
+
+For every configuration it reports the mean lines cleared and lines/piece ratio with their 95% confidence
+intervals (Student's t, since there are usually only a handful of runs), and the 50th/90th/99th percentiles
+of how long a single getAction call took over all of its runs.
+
+Depth means the search depth getAction is called with for the two expectimax agents, and the number of
+pieces the beam places for beamSearchChance (the known ones, then random ones past 3). Beam width only
+applies to the two beam agents. Leaving either out uses the agent's default.
+
+--lockstep plays the runs of each configuration side by side in this process instead (see lockstepSimulator),
+with one agent for all of them. The games and lines are the same; beamSearchChance with the classic evaluator
+and a depth up to 3 is batched across the runs, every other configuration is asked run by run. The move
+times are then each run's even share of a lockstep step rather than single getAction calls.
+"""
+
+import argparse
+import math
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from gameSimulator import TetrisApp
+from lockstepSimulator import LockstepGames
+from expectimaxAgent import expectimaxAgent
+from beamPrunedExpectimaxAgent import beamPrunedExpectimaxAgent
+from beamsearchChanceAgent import beamsearchChanceAgent
+from evaluation import EVALUATORS
+from pieceSource import SOURCES, SequenceFilePieces, piece_source
+
+AGENTS = {
+    "expectimax": expectimaxAgent,
+    "beamSearchChance": beamsearchChanceAgent,
+    "beamPrunedExpectimax": beamPrunedExpectimaxAgent,
+}
+
+# the agents a beam width can be given to
+BEAM_AGENTS = {"beamSearchChance", "beamPrunedExpectimax"}
+
+# the smallest depth and beam width every agent searches with: one placement of the current piece, one survivor
+MIN_DEPTH = 1
+MIN_BEAM_WIDTH = 1
+
+# two-sided 95% quantiles of Student's t distribution by degrees of freedom. Degrees of freedom between two
+# entries use the smaller one's quantile, which is a little larger, so the intervals are never too narrow
+T_QUANTILES = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228,
+    11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110, 18: 2.101, 19: 2.093,
+    20: 2.086, 25: 2.060, 30: 2.042, 40: 2.021, 60: 2.000, 120: 1.980,
+}
+
+
+def run_seed(seed, run):
+    """
+    The pieces seed of run `run`, the same for every configuration
+    """
+    return random.Random(f"{seed}:{run}").getrandbits(64)
+
+
+def configurations(agents, depths, beams, pieces, evaluator):
+    """
+    Every (agent, depth, beam width, pieces, evaluator) to benchmark. Beam widths are only combined with
+    the agents that have one. Raises ValueError for a depth or beam width an agent can't search with, so
+    a bad setting is caught before any game is played rather than in a worker process.
+    """
+    configs = []
+
+    for agent in agents:
+        for depth in depths:
+            if depth is not None and depth < MIN_DEPTH:
+                raise ValueError(f"{agent} can't search depth {depth}, expected at least {MIN_DEPTH}")
+
+            for beam in (beams if agent in BEAM_AGENTS else [None]):
+                if beam is not None and beam < MIN_BEAM_WIDTH:
+                    raise ValueError(f"{agent} can't search with beam width {beam}, expected at least {MIN_BEAM_WIDTH}")
+
+                for maxPieces in pieces:
+                    configs.append((agent, depth, beam, maxPieces, evaluator))
+
+    return configs
+
+
+def run_pieces(source, seed, sequence, run, maxPieces):
+    """
+    The piece source of run `run`: the seeded source, or its own stretch of the sequence file
+    (every game draws its three queue pieces plus at most one piece per move)
+    """
+    if sequence is not None:
+        return SequenceFilePieces(sequence, run * (maxPieces + 3))
+
+    return piece_source(source, run_seed(seed, run))
+
+
+def build_agent(config):
+    """
+    The agent of a configuration, and the depth its getAction is called with (None: its own)
+    """
+    agentName, depth, beam, maxPieces, evaluator = config
+    settings = {"evaluator": evaluator}
+
+    if beam is not None:
+        settings["beam_width"] = beam
+
+    if agentName == "beamSearchChance":
+        # its depth is part of the agent rather than an argument of getAction
+        if depth is not None:
+            settings["depth"] = depth
+        depth = None
+
+    return AGENTS[agentName](agentName, **settings), depth
+
+
+def play(config, source, seed, sequence, run):
+    """
+    Plays run `run` of a configuration and returns limitGameLoop's metrics
+    """
+    maxPieces = config[3]
+    agent, depth = build_agent(config)
+    # the source is built here in the worker, a memory-mapped sequence can't be sent to it
+    app = TetrisApp(agent, headless=True, pieces=run_pieces(source, seed, sequence, run, maxPieces))
+
+    return app.limitGameLoop(maxPieces, depth)
+
+
+def confidence_interval(values):
+    """
+    Returns the mean of values and the half width of its 95% confidence interval (0 for a single value)
+    """
+    mean = statistics.mean(values)
+
+    if len(values) < 2:
+        return mean, 0.0
+
+    df = len(values) - 1
+    t = T_QUANTILES[max(k for k in T_QUANTILES if k <= df)]
+
+    return mean, t * statistics.stdev(values) / math.sqrt(len(values))
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """
+    The given percentiles of values (linear interpolation between the closest ranks)
+    """
+    if len(values) < 2:
+        return [values[0] if values else 0.0 for _ in points]
+
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return [cuts[point - 1] for point in points]
+
+
+def summarize(config, results):
+    """
+    Aggregates the metrics of every run of a configuration
+    """
+    agentName, depth, beam, maxPieces, evaluator = config
+    lines, linesHalfWidth = confidence_interval([r["lines"] for r in results])
+    ratio, ratioHalfWidth = confidence_interval([r["lines"] / r["pieces"] if r["pieces"] else 0.0 for r in results])
+    latencies = percentiles([t for r in results for t in r["move_times"]])
+
+    return {
+        "agent": agentName,
+        "depth": depth,
+        "beam_width": beam,
+        "pieces": maxPieces,
+        "evaluator": evaluator,
+        "runs": len(results),
+        "lines_mean": lines,
+        "lines_ci95": linesHalfWidth,
+        "ratio_mean": ratio,
+        "ratio_ci95": ratioHalfWidth,
+        "move_ms_p50": latencies[0] * 1000,
+        "move_ms_p90": latencies[1] * 1000,
+        "move_ms_p99": latencies[2] * 1000,
+        "results": [{"lines": r["lines"], "pieces": r["pieces"], "time": r["time"]} for r in results],
+    }
+
+
+def run_benchmark(configs, runs, seed=0, workers=None, source="uniform", sequence=None):
+    """
+    Plays `runs` games of every configuration across `workers` processes (all cores by default) and
+    returns one summary per configuration, in configs order
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            [executor.submit(play, config, source, seed, sequence, run) for run in range(runs)]
+            for config in configs
+        ]
+        return [summarize(config, [future.result() for future in runFutures]) for config, runFutures in zip(configs, futures)]
+
+
+def run_lockstep_benchmark(configs, runs, seed=0, source="uniform", sequence=None):
+    """
+    Plays the `runs` games of every configuration side by side in this process, one LockstepGames per
+    configuration, and returns one summary per configuration, in configs order
+    """
+    summaries = []
+
+    for config in configs:
+        maxPieces = config[3]
+        agent, depth = build_agent(config)
+        games = LockstepGames(runs, agent=agent, depth=depth,
+                              sources=[run_pieces(source, seed, sequence, run, maxPieces) for run in range(runs)])
+        summaries.append(summarize(config, games.run(maxPieces)))
+
+    return summaries
+
+
+def format_table(summaries):
+    """
+    Formats the summaries as a markdown table
+    """
+    lines = [
+        "| Agent | Depth | Beam | Pieces | Runs | Lines Cleared | Lines/Piece | Move p50 | Move p90 | Move p99 |",
+        "|-------|-------|------|--------|------|---------------|-------------|----------|----------|----------|",
+    ]
+
+    for s in summaries:
+        lines.append(
+            f"| {s['agent']} | {s['depth'] if s['depth'] is not None else '-'} | "
+            f"{s['beam_width'] if s['beam_width'] is not None else '-'} | {s['pieces']} | {s['runs']} | "
+            f"{s['lines_mean']:.2f} ± {s['lines_ci95']:.2f} | {s['ratio_mean']:.4f} ± {s['ratio_ci95']:.4f} | "
+            f"{s['move_ms_p50']:.1f}ms | {s['move_ms_p90']:.1f}ms | {s['move_ms_p99']:.1f}ms |"
+        )
+
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the agents over a matrix of settings in parallel.")
+    parser.add_argument("--agents", nargs="+", choices=sorted(AGENTS), default=["beamPrunedExpectimax", "beamSearchChance"])
+    parser.add_argument("--depths", nargs="+", type=int, default=[None], help="search depths (default: each agent's own)")
+    parser.add_argument("--beams", nargs="+", type=int, default=[None], help="beam widths of the beam agents (default: their own)")
+    parser.add_argument("--pieces", nargs="+", type=int, default=[10, 20, 50], help="pieces played per game")
+    parser.add_argument("--runs", type=int, default=5, help="games per configuration")
+    parser.add_argument("--seed", type=int, default=0, help="seed the pieces of every run are derived from")
+    parser.add_argument("--source", choices=sorted(SOURCES), default="uniform", help="how the seeded pieces are drawn")
+    parser.add_argument("--sequence", help="replay the pieces of this sequence file instead of drawing them")
+    parser.add_argument("--workers", type=int, default=None, help=f"worker processes (default: {os.cpu_count()})")
+    parser.add_argument("--evaluator", choices=sorted(EVALUATORS), default="classic", help="evaluator of every agent")
+    parser.add_argument("--lockstep", action="store_true", help="play each configuration's runs side by side in this process")
+    parser.add_argument("--json", help="also write the summaries (and every run's metrics) to this file")
+    args = parser.parse_args(argv)
+
+    try:
+        configs = configurations(args.agents, args.depths, args.beams, args.pieces, args.evaluator)
+    except ValueError as error:
+        parser.error(str(error))
+
+    start_time = time.time()
+    if args.lockstep:
+        summaries = run_lockstep_benchmark(configs, args.runs, args.seed, args.source, args.sequence)
+    else:
+        summaries = run_benchmark(configs, args.runs, args.seed, args.workers, args.source, args.sequence)
+
+    print(format_table(summaries))
+    print(f"\n{len(configs) * args.runs} games in {time.time() - start_time:.1f}s")
+
+    if args.json:
+        import json
+
+        with open(args.json, "w") as f:
+            json.dump(summaries, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Sparse sampling of chance nodes.
+
+A chance node averages the values of all 7 pieces that can be drawn next, and each of those is a whole
+subtree. Deep in the search, where the value of a single node matters least, a ChanceSampler instead draws
+pieces one at a time (without replacement) and stops once the average is known well enough:
+    - at least `min_samples` pieces are always searched
+    - after that it stops as soon as the `confidence` interval of the mean (normal approximation, with the
+      finite population correction since only 7 pieces exist) is within +-`tolerance` score points
+    - a piece that loses the game (-inf) makes the average -inf whatever the others score, so it stops there
+Chance nodes that draw a piece after more than `exact_plies` placements of the search are sampled; the
+ones closer to the root, which decide the move, still see every piece. With the default of 1 only the
+chance nodes right below the root moves are searched in full. Since the same node is sampled or not
+depending on the root depth, agents only share sampled values between searches from the same root depth.
+
+The order pieces are drawn in is one of PERMUTATIONS permutations generated from `seed`, picked by the
+node itself (its Zobrist hash, action and depth) rather than taken from a shared random stream. A node is
+therefore sampled the same way every time it is reached, whatever order the search visits nodes in and in
+whichever worker process, which keeps runs reproducible and transposition table entries consistent.
+"""
+
+import math
+import random
+
+from TetrisStateSpace import PIECES
+
+
+class ChanceSampler:
+
+    PERMUTATIONS = 4096
+
+    def __init__(self, seed=0, min_samples=3, tolerance=0.3, confidence=1.96, exact_plies=1):
+        if not 1 <= min_samples <= len(PIECES):
+            raise ValueError(f"min_samples must be between 1 and {len(PIECES)}")
+
+        self.seed = seed
+        self.min_samples = min_samples
+        self.tolerance = tolerance
+        self.confidence = confidence
+        self.exact_plies = exact_plies
+        rng = random.Random(seed)
+        self.orders = [tuple(rng.sample(PIECES, len(PIECES))) for _ in range(self.PERMUTATIONS)]
+        self.sampledNodes = 0
+        self.samplesTaken = 0
+
+    def variant(self):
+        """
+        The settings that change the values a search computes, for transposition table keys
+        """
+        return ("sampled", self.seed, self.min_samples, self.tolerance, self.confidence, self.exact_plies)
+
+    def samples(self, plies):
+        """
+        Whether a chance node reached after placing `plies` pieces from the root (its own included) is sampled
+        """
+        return plies > self.exact_plies
+
+    def expected_value(self, value, node_key):
+        """
+        Estimates the average of value(piece) over all pieces by sampling, where node_key identifies the
+        chance node (it seeds the order pieces are drawn in)
+        """
+        count = len(PIECES)
+        order = self.orders[hash(node_key) % self.PERMUTATIONS]
+        total = 0.0
+        squares = 0.0
+        n = 0
+
+        for piece in order:
+            score = value(piece)
+            n += 1
+
+            if score == -float("inf"):
+                total = score
+                break
+
+            total += score
+            squares += score * score
+
+            if self.min_samples <= n < count:
+                mean = total / n
+                variance = max(squares / n - mean * mean, 0.0) * n / (n - 1) if n > 1 else 0.0
+                halfWidth = self.confidence * math.sqrt(variance / n * (count - n) / (count - 1))
+
+                if halfWidth <= self.tolerance:
+                    break
+
+        self.sampledNodes += 1
+        self.samplesTaken += n
+
+        return total / n
+
+    def stats(self):
+        """
+        Returns how many chance nodes were sampled and how many pieces they searched on average
+        """
+        return {
+            "sampled_nodes": self.sampledNodes,
+            "samples_taken": self.samplesTaken,
+            "mean_samples": self.samplesTaken / self.sampledNodes if self.sampledNodes else 0.0
+        }
@@ -0,0 +1,327 @@
+"""
+The Dellacherie-style heuristic shared by all of our agents.
+
+A board is scored from three features, aggregate column height, holes and bumpiness (the sum of height
+differences between neighbouring columns), plus the lines cleared so far. The agents used to carry their
+own copy of this function and recompute every feature with a double loop over the 200 cells. Instead the
+features now live on the states: TetrisStateSpace.place_piece derives a child's features from its parent's
+by only looking at the (at most 4) columns the piece touched and their neighbours, and only sums the ten
+column skyline again after a line clear. Scoring a state is then a constant-time weighted sum:
+    evaluate(state)                 one TetrisStateSpace or Afterstate
+    evaluate_successors(batch)      every child of a TetrisStateSpace.successor_batch() in one call
+    evaluate_batch(boards, lines)   N raw boards given as an (N, 20, 10) array of 0/1 cells or an (N, 20)
+                                    array of packed rows, with the features computed vectorized by NumPy
+
+The integer features are exact and are always combined with the same weights in the same order, so all
+three give identical scores for the same board and swapping one for another never changes a decision.
+NumPy is optional: evaluate_successors falls back to plain Python when it is missing, evaluate_batch needs it.
+
+The "dellacherie" evaluator scores Pierre Dellacherie's full feature set instead, with his hand tuned weights:
+    landing height          height of the middle of the last placed piece
+    eroded piece cells      lines the last placement cleared times the cells of the piece that went with them
+    row transitions         filled/empty changes along each row, the walls count as filled
+    column transitions      filled/empty changes down each column, the floor counts as filled
+    holes                   empty cells below the top of their column
+    well sums               sum over every well (empty cells with both neighbours filled) of 1 + 2 + ... + depth
+The last two placement features come from the state's `placement`, holes from its features, and the rest
+are read off the packed rows with tables precomputed over all 1024 row patterns: one lookup per row for its
+transitions and well cells, and an XOR of neighbouring rows for the column transitions of all ten columns at
+once. Rows above the stack are empty, so only the rows from the top of the stack down are visited.
+
+Agents pick their evaluator by name, see get_evaluator. Searches that prune with bounds on the scores
+(expectimaxAgent's star1 mode) also need get_upper_bound, which only the classic evaluator has so far.
+The one-ply best response of a chance node's leaves (the best score any placement of a given piece reaches)
+has its own kernel per evaluator, see get_best_response: it reads the children straight off the board with
+TetrisStateSpace.placement_features / placement_boards instead of building a state and a successor batch.
+"""
+
+from TetrisStateSpace import TetrisStateSpace
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# punish height increases because they reduce available space and increase risk of topping out
+HEIGHT_WEIGHT = -0.51
+# reward number of lines cleared
+LINES_WEIGHT = 0.76
+# punish hole creation because they make it impossible to clear lines for the blocks around them
+HOLES_WEIGHT = -0.36
+# punish bumpiness to prioritize moves that lead to a flatter board space
+BUMPINESS_WEIGHT = -0.18
+
+ROWS = TetrisStateSpace.ROWS
+COLUMNS = TetrisStateSpace.COLUMNS
+
+# Dellacherie's weights
+LANDING_HEIGHT_WEIGHT = -1
+ERODED_CELLS_WEIGHT = 1
+ROW_TRANSITIONS_WEIGHT = -1
+COLUMN_TRANSITIONS_WEIGHT = -1
+DELLACHERIE_HOLES_WEIGHT = -4
+WELL_SUMS_WEIGHT = -1
+
+# below this many boards the NumPy call overhead costs more than the Python loop it replaces
+NUMPY_MIN_BATCH = 16
+
+FULL_ROW = TetrisStateSpace.FULL_ROW
+
+# lookup tables indexed by a packed row (bit c = column c)
+POPCOUNT = tuple(bin(mask).count("1") for mask in range(FULL_ROW + 1))
+# the row is padded with a filled wall cell on both sides before counting the changes between neighbours
+ROW_TRANSITIONS = tuple(
+    bin((walled ^ (walled >> 1)) & ((1 << (COLUMNS + 1)) - 1)).count("1")
+    for walled in ((mask << 1) | 1 | (1 << (COLUMNS + 1)) for mask in range(FULL_ROW + 1))
+)
+# the empty cells of a row whose left and right neighbours (or walls) are filled
+ROW_WELLS = tuple(~mask & ((mask << 1) | 1) & ((mask >> 1) | (1 << (COLUMNS - 1))) & FULL_ROW for mask in range(FULL_ROW + 1))
+
+
+def combine(aggregateHeight, holes, bumpiness, lines):
+    """
+    The weighted sum shared by every evaluator. Works on plain numbers and on NumPy arrays alike.
+    """
+    return (
+        HEIGHT_WEIGHT * aggregateHeight
+        + HOLES_WEIGHT * holes
+        + BUMPINESS_WEIGHT * bumpiness
+        + LINES_WEIGHT * lines
+    )
+
+
+def evaluate(state):
+    """
+    Scores a single state (or afterstate) from the features it carries
+    """
+    aggregateHeight, holes, bumpiness = state.features
+    return combine(aggregateHeight, holes, bumpiness, state.lines)
+
+
+def evaluate_batch(boards, lines):
+    """
+    Scores N boards at once. boards is an (N, 20, 10) array of 0/1 cells or an (N, 20) array of packed
+    rows (bit c of a row = column c), lines is the lines count of each board (or one count for all of
+    them). Returns an (N,) float array.
+    """
+    if np is None:
+        raise ImportError("NumPy is required for evaluate_batch (pip install numpy)")
+
+    boards = np.asarray(boards)
+
+    if boards.ndim == 2:
+        boards = (boards[:, :, None] >> np.arange(COLUMNS)) & 1
+
+    filled = boards.astype(bool)
+
+    # a column's height is measured from its first filled cell, top down
+    occupied = filled.any(axis=1)
+    heights = np.where(occupied, ROWS - filled.argmax(axis=1), 0)
+
+    # once a column has been covered, every empty cell below is a hole
+    covered = np.logical_or.accumulate(filled, axis=1)
+    holes = (covered & ~filled).sum(axis=(1, 2))
+
+    bumpiness = np.abs(np.diff(heights, axis=1)).sum(axis=1)
+
+    return combine(heights.sum(axis=1), holes, bumpiness, np.asarray(lines))
+
+
+def evaluate_successors(batch):
+    """
+    Scores every child of a SuccessorBatch and returns the scores as a list, in batch.moves order.
+    """
+    if np is not None and len(batch) >= NUMPY_MIN_BATCH:
+        aggregateHeights = np.frombuffer(batch.aggregate_heights, dtype=np.uint16).astype(np.int64)
+        holes = np.frombuffer(batch.holes, dtype=np.uint16).astype(np.int64)
+        bumpiness = np.frombuffer(batch.bumpiness, dtype=np.uint16).astype(np.int64)
+        lines = batch.lines + np.frombuffer(batch.cleared, dtype=np.uint8).astype(np.int64)
+
+        return combine(aggregateHeights, holes, bumpiness, lines).tolist()
+
+    lines = batch.lines
+    return [
+        combine(aggregateHeight, holes, bumpiness, lines + cleared)
+        for aggregateHeight, holes, bumpiness, cleared in zip(batch.aggregate_heights, batch.holes, batch.bumpiness, batch.cleared)
+    ]
+
+
+def combine_dellacherie(landingHeight, erodedCells, rowTransitions, columnTransitions, holes, wellSums):
+    """
+    The weighted sum of the dellacherie evaluator
+    """
+    return (
+        LANDING_HEIGHT_WEIGHT * landingHeight
+        + ERODED_CELLS_WEIGHT * erodedCells
+        + ROW_TRANSITIONS_WEIGHT * rowTransitions
+        + COLUMN_TRANSITIONS_WEIGHT * columnTransitions
+        + DELLACHERIE_HOLES_WEIGHT * holes
+        + WELL_SUMS_WEIGHT * wellSums
+    )
+
+
+def dellacherie_features(rows, top, holes, placement):
+    """
+    Returns the (landing height, eroded piece cells, row transitions, column transitions, holes, well sums)
+    of a board given as packed rows, where top is the index of its highest non-empty row (ROWS when empty)
+    and placement the (landing height, eroded cells) of the move that produced it, or None.
+    """
+    landingHeight, erodedCells = placement if placement is not None else (0, 0)
+
+    # every empty row above the stack changes from wall to empty and back, and adds nothing else
+    rowTransitions = 2 * top
+    columnTransitions = 0
+    wellSums = 0
+    above = 0
+    # runs[k] holds the columns whose well has gone on for more than k rows by now
+    runs = []
+
+    for mask in rows[top:]:
+        rowTransitions += ROW_TRANSITIONS[mask]
+        columnTransitions += POPCOUNT[mask ^ above]
+        above = mask
+
+        wells = ROW_WELLS[mask]
+
+        if wells:
+            # a well cell is one deeper than the cell above it if that one was in the same well
+            runs = [wells] + [run & wells for run in runs if run & wells]
+
+            for run in runs:
+                wellSums += POPCOUNT[run]
+        else:
+            runs = []
+
+    # the floor below the last row counts as filled
+    columnTransitions += POPCOUNT[above ^ FULL_ROW]
+
+    return landingHeight, erodedCells, rowTransitions, columnTransitions, holes, wellSums
+
+
+def evaluate_dellacherie(state):
+    """
+    Scores a single state (or afterstate) with the dellacherie evaluator
+    """
+    return combine_dellacherie(*dellacherie_features(state.rows, ROWS - max(state.heights), state.features[1], state.placement))
+
+
+def evaluate_dellacherie_successors(batch):
+    """
+    Scores every child of a SuccessorBatch with the dellacherie evaluator, in batch.moves order.
+    """
+    scores = []
+    rows = batch.rows
+    heights = batch.heights
+
+    for i in range(len(batch)):
+        top = ROWS - max(heights[i * COLUMNS:(i + 1) * COLUMNS])
+        features = dellacherie_features(rows[i * ROWS:(i + 1) * ROWS], top, batch.holes[i], batch.placements[i])
+        scores.append(combine_dellacherie(*features))
+
+    return scores
+
+
+# the evaluators agents can be built with, as (evaluate, evaluate_successors) pairs
+EVALUATORS = {
+    "classic": (evaluate, evaluate_successors),
+    "dellacherie": (evaluate_dellacherie, evaluate_dellacherie_successors),
+}
+
+
+def get_evaluator(name):
+    """
+    Returns the (evaluate, evaluate_successors) pair registered under name
+    """
+    if name not in EVALUATORS:
+        raise ValueError(f"unknown evaluator '{name}', expected one of {sorted(EVALUATORS)}")
+
+    return EVALUATORS[name]
+
+
+def classic_upper_bound(state, placements):
+    """
+    An upper bound on the classic score of any state reached from state by placing at most `placements`
+    more pieces. A column's height is its filled cells plus its holes, so with the (negative) height, holes and
+    bumpiness weights a board scores at most HEIGHT_WEIGHT * cells + LINES_WEIGHT * lines. Each piece adds
+    4 cells and each cleared line takes 10 away, and at most 4 lines (and no more than the cells allow) are
+    cleared per piece.
+    """
+    aggregateHeight, holes, _ = state.features
+    cells = aggregateHeight - holes
+    best = -float("inf")
+
+    for k in range(placements + 1):
+        cleared = min(4 * k, (cells + 4 * k) // 10)
+        best = max(best, HEIGHT_WEIGHT * (cells + 4 * k - 10 * cleared) + LINES_WEIGHT * (state.lines + cleared))
+
+    return best
+
+
+def best_response(state, piece):
+    """
+    The best classic score of any placement of piece on state (whatever piece is next in its queue),
+    -inf if the piece can't be placed
+    """
+    lines = state.lines
+    best = -float("inf")
+
+    for cleared, aggregateHeight, holes, bumpiness in state.placement_features(piece):
+        score = combine(aggregateHeight, holes, bumpiness, lines + cleared)
+
+        if score > best:
+            best = score
+
+    return best
+
+
+def best_response_dellacherie(state, piece):
+    """
+    The best dellacherie score of any placement of piece on state, -inf if the piece can't be placed
+    """
+    best = -float("inf")
+
+    for rows, heights, holes, placement in state.placement_boards(piece):
+        score = combine_dellacherie(*dellacherie_features(rows, ROWS - max(heights), holes, placement))
+
+        if score > best:
+            best = score
+
+    return best
+
+
+# the one-ply best response kernel of every evaluator
+BEST_RESPONSES = {
+    "classic": best_response,
+    "dellacherie": best_response_dellacherie,
+}
+
+
+def get_best_response(name):
+    """
+    Returns the best response kernel of the evaluator registered under name
+    """
+    if name not in BEST_RESPONSES:
+        raise ValueError(f"unknown evaluator '{name}', expected one of {sorted(BEST_RESPONSES)}")
+
+    return BEST_RESPONSES[name]
+
+
+# the evaluators that also score the move that produced a state (its placement), so the same board reached
+# through different moves can score differently
+PLACEMENT_EVALUATORS = {"dellacherie"}
+
+
+# the evaluators a value bound is known for, which bound-based pruning needs
+UPPER_BOUNDS = {
+    "classic": classic_upper_bound,
+}
+
+
+def get_upper_bound(name):
+    """
+    Returns the upper bound function of the evaluator registered under name
+    """
+    if name not in UPPER_BOUNDS:
+        raise ValueError(f"no value bound is known for evaluator '{name}', expected one of {sorted(UPPER_BOUNDS)}")
+
+    return UPPER_BOUNDS[name]
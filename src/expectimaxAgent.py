@@ -1,35 +1,90 @@
 from TetrisStateSpace import TetrisStateSpace
+from transpositionTable import TranspositionTable
+from evaluation import get_upper_bound
+from chanceSampling import ChanceSampler
+from searchAgent import SearchAgent
+
+# slack added to the Star1 score bounds so float rounding in the expected value sums can never
+# make a cut discard a move the plain search would have picked
+STAR1_TOLERANCE = 1e-9
+
+
+class expectimaxAgent(SearchAgent):
+    DEFAULT_DEPTH = 3
+
+    # pass a shared TranspositionTable to let several agents consult the same values,
+    # or TranspositionTable(max_entries=0) to search without one
+    # evaluator picks the heuristic from evaluation.EVALUATORS ("classic" or "dellacherie")
+    # pruning="star1" cuts off chance nodes that provably can't change the move (needs an evaluator with a value bound)
+    # workers > 0 searches the root moves of fixed depth searches in that many worker processes
+    # sampling=ChanceSampler(...) only searches a sample of the pieces at the deeper chance nodes
+    # the afterstates of the branch the game took are kept for the next move, in up to tree_memory_mb (0: off)
+    # dedupe=True only expands one of the placements that leave the same board
+    def __init__(self, agentName: str, transposition_table: TranspositionTable = None, evaluator: str = "classic",
+                 pruning: str = None, workers: int = None, sampling: ChanceSampler = None, tree_memory_mb: float = 64,
+                 dedupe: bool = False):
+        if pruning not in (None, "star1"):
+            raise ValueError(f"unknown pruning '{pruning}', expected None or 'star1'")
+
+        if pruning is not None and sampling is not None:
+            # the bounds star1 cuts with only hold for averages over every piece
+            raise ValueError("star1 pruning can't be combined with chance node sampling")
+
+        # both searches compute exactly the same values, so they share table entries, sampled ones don't.
+        # Deduped ones don't either: the placement dedupe leaves out leaves the same board as the one it
+        # keeps, but an evaluator that scores placements can score the two differently
+        super().__init__(agentName, ("expectimax", evaluator, dedupe), transposition_table, evaluator, workers,
+                         sampling, tree_memory_mb, dedupe)
+        self.pruning = pruning
+        self.upperBound = get_upper_bound(evaluator) if pruning is not None else None
+        # search nodes visited so far, to compare the searches with (not counting the worker processes)
+        self.nodesExpanded = 0
+
+    def searchAction(self, currGameState: TetrisStateSpace, depth: int, possibleMoves):
+        if self.pruning == "star1":
+            return self.star1Action(currGameState, depth)
+
+        return super().searchAction(currGameState, depth, possibleMoves)
+
+    def rootValue(self, currGameState: TetrisStateSpace, depth: int, move):
+        if self.pruning == "star1":
+            self.startSearch(depth)
+            # nothing is cut at the root without a best move to compare with, only further down
+            return self.star1(currGameState, depth, move, False, -float("inf"))[0]
+
+        return super().rootValue(currGameState, depth, move)
+
+    def workerSettings(self):
+        return {**super().workerSettings(), "pruning": self.pruning}
+
+    # Star1 version of getAction: the statically best moves are searched first, and every later move only
+    # has to prove it can beat the best value so far. Moves that can't are cut off, so the move found is
+    # the one the plain search picks (including which one wins a tie), with far fewer nodes expanded
+    def star1Action(self, currGameState: TetrisStateSpace, depth: int):
+        successors = currGameState.successor_batch(self.dedupe)
+        staticScores = self.evaluateSuccessors(successors)
+        values = [None] * len(successors)
+        bestScore = -float("inf")
 
-HEIGHT_WEIGHT = -0.51
-LINES_WEIGHT = 0.76
-HOLES_WEIGHT = -0.36
-BUMPINESS_WEIGHT = -0.18
-
-class expectimaxAgent:
-    def __init__(self, agentName: str):
-        self.agentName = agentName
-
-    # This needed to be adjusted to simulate the next
-    def getAction(self, currGameState: TetrisStateSpace, depth: int = 3):
-        #loops over all potential moves and returns the one with the highest score
-        possibleMoves = currGameState.legal_placements()
-
-        if not possibleMoves:
-            return None
+        for i in sorted(range(len(successors)), key=staticScores.__getitem__, reverse=True):
+            score, exact = self.star1(currGameState, depth, successors.moves[i], False, bestScore - STAR1_TOLERANCE,
+                                      self.buildAfterstate(currGameState, successors.moves[i], lambda: successors.afterstate(i)))
+            # a move that was cut off scores below the best one, so only exact values can win
+            if exact:
+                values[i] = score
+                bestScore = max(bestScore, score)
 
+        # the plain search keeps the first of equally good moves in legal_placements order
         bestScore = -float("inf")
         bestMove = None
 
-        for (col, orientation) in possibleMoves:
-            # but expectiMax now properly alternates max/chance and uses depth
-            score = self.expectiMax(currGameState, depth, (col, orientation), False)
-            #print(score)
-            if score > bestScore:
+        for move, score in zip(successors.moves, values):
+            if score is not None and score > bestScore:
                 bestScore = score
-                bestMove = (col, orientation)
-            
+                bestMove = move
+
         return bestMove
-    
+
 
     # the current gamestate actually has the piece that we are supposed to put down stored in the queue
     # the queue contains the next 3 pieces that will be placed by the player
@@ -37,6 +92,11 @@ class expectimaxAgent:
     def expectiMax(self, gameState: TetrisStateSpace, depth: int, action, isMaxAgent: bool):
         #alternating maxAgent and randomAgent
         #simulate placing each piece, and use evaluation function on each move
+        self.nodesExpanded += 1
+
+        # anytime mode: abandon this iteration once the deadline has passed
+        if self.deadline is not None:
+            self.deadline.check()
 
         # If terminal, stop
         if gameState.is_terminal() or depth <=0:
@@ -45,15 +105,27 @@ class expectimaxAgent:
         # If depth reached, stop
         #if isMaxAgent or depth <= 0:
             #return self.evaluationFunction(gameState)
+
+        # positions reached through a different move order were already searched
+        if isMaxAgent:
+            key = TranspositionTable.max_key(gameState, depth, self.searchVariant, self.relevantPieces(depth, True),
+                                             self.keyPlacement)
+        else:
+            key = TranspositionTable.chance_key(gameState, depth, action, self.searchVariant, self.relevantPieces(depth, False))
+
+        cached = self.transpositions.lookup(key)
+        if cached is not None:
+            return cached
     
         if isMaxAgent:
             maxScore = -float("inf")
 
-            for (col, orientation) in gameState.legal_placements():
+            for (col, orientation) in gameState.legal_placements(self.dedupe):
                 score = self.expectiMax(gameState, depth - 1 , (col, orientation), isMaxAgent=False)
 
                 maxScore = max(score, maxScore)
 
+            self.transpositions.store(key, maxScore)
             return maxScore
         else:
             (col, orientation) = action
@@ -61,49 +133,109 @@ class expectimaxAgent:
 
             # for the chance node, simulate the random next piece from the game
             # don't decrement depth
-            for piece in gameState.VALID_SHAPES:
-                newState = gameState.place_piece(col, orientation, piece)
-                # max agent does not need action
-                score = self.expectiMax(newState, depth , None, isMaxAgent=True)
-                expectedScore += score / len(gameState.VALID_SHAPES)
-
+            # the placement itself doesn't depend on the random piece, so it is only done once
+            afterstate = self.buildAfterstate(gameState, action, lambda: gameState.afterstate(col, orientation))
+
+            if self.sampling is not None and self.sampling.samples(self.searchRootDepth - depth + 1):
+                # deep chance nodes only search as many pieces as it takes to pin the average down
+                expectedScore = self.sampling.expected_value(
+                    lambda piece: self.expectiMax(afterstate.spawn(piece), depth, None, isMaxAgent=True),
+                    (gameState.zobrist, action, depth))
+            else:
+                for piece in gameState.VALID_SHAPES:
+                    newState = afterstate.spawn(piece)
+                    # max agent does not need action
+                    score = self.expectiMax(newState, depth , None, isMaxAgent=True)
+                    expectedScore += score / len(gameState.VALID_SHAPES)
+
+            self.transpositions.store(key, expectedScore)
             return expectedScore
+
+    # expectiMax with Star1 pruning (Ballard's *-minimax). Returns (value, exact): exact values are the very
+    # same floats expectiMax computes, otherwise the node can score at most value, which is <= alpha, and
+    # nothing this node could score would change the move chosen above it.
+    # Chance nodes know the best any child can score (the evaluator's upper bound over the pieces still to be
+    # placed below them), so once the children seen so far plus that bound for the rest can't beat alpha the
+    # remaining children are skipped. Only alpha (fail low) cuts exist here: the Star2 probing that gives beta
+    # cuts needs a finite beta, and with no minimizing player above us beta is always +inf.
+    def star1(self, gameState: TetrisStateSpace, depth: int, action, isMaxAgent: bool, alpha: float, afterstate=None):
+        self.nodesExpanded += 1
+
+        # anytime mode: abandon this iteration once the deadline has passed
+        if self.deadline is not None:
+            self.deadline.check()
+
+        if gameState.is_terminal() or depth <= 0:
+            return self.evaluationFunction(gameState), True
+
+        if isMaxAgent:
+            key = TranspositionTable.max_key(gameState, depth, self.searchVariant, self.relevantPieces(depth, True),
+                                             self.keyPlacement)
+        else:
+            key = TranspositionTable.chance_key(gameState, depth, action, self.searchVariant, self.relevantPieces(depth, False))
+
+        cached = self.transpositions.lookup(key)
+        if cached is not None:
+            return cached, True
+
+        if isMaxAgent:
+            if depth == 1:
+                # every move leads to a chance node at depth 0, which scores this state itself
+                score = self.evaluationFunction(gameState)
+                self.transpositions.store(key, score)
+                return score, True
+
+            # children with the best static score first, so alpha rises early for the rest
+            successors = gameState.successor_batch(self.dedupe)
+            staticScores = self.evaluateSuccessors(successors)
+            maxScore = -float("inf")
+            maxBound = -float("inf")
+
+            for i in sorted(range(len(successors)), key=staticScores.__getitem__, reverse=True):
+                score, exact = self.star1(gameState, depth - 1, successors.moves[i], False, max(alpha, maxScore),
+                                          self.buildAfterstate(gameState, successors.moves[i], lambda: successors.afterstate(i)))
+                if exact:
+                    maxScore = max(maxScore, score)
+                else:
+                    maxBound = max(maxBound, score)
+
+            # a child that was cut off scores at most its bound, which only matters if that could be the max
+            if maxBound > maxScore:
+                return maxBound, False
+
+            self.transpositions.store(key, maxScore)
+            return maxScore, True
+        else:
+            (col, orientation) = action
+            numPieces = len(gameState.VALID_SHAPES)
+
+            if afterstate is None:
+                afterstate = self.buildAfterstate(gameState, action, lambda: gameState.afterstate(col, orientation))
+
+            # no max node below can score more than this: its leaves are at most depth - 1 more pieces away
+            upper = self.upperBound(afterstate, depth - 1) + STAR1_TOLERANCE
+            # summed exactly like expectiMax does, so exact values come out bit for bit the same
+            expectedScore = 0
+
+            for remaining, piece in zip(range(numPieces, 0, -1), gameState.VALID_SHAPES):
+                bound = expectedScore + remaining * upper / numPieces
+                if bound <= alpha:
+                    return bound, False
+
+                # the score this child needs for the node to still be able to beat alpha
+                childAlpha = (alpha - expectedScore - (remaining - 1) * upper / numPieces) * numPieces
+                score, exact = self.star1(afterstate.spawn(piece), depth, None, True, childAlpha)
+
+                if not exact:
+                    return expectedScore + score / numPieces + (remaining - 1) * upper / numPieces, False
+
+                expectedScore += score / numPieces
+
+            self.transpositions.store(key, expectedScore)
+            return expectedScore, True
     
-    # Referencing Pierre Dellacherie's Algorithm
-    # modify this to also make this take the queue's "fit" to the board
-    def evaluationFunction(self, currGameState: TetrisStateSpace):
-        board = currGameState.board
-        rows = len(board)
-        cols = len(board[0])
-
-        aggregateHeight = 0
-        columnHeights = [0] * cols
-        holes = 0
-
-        for c in range(cols):
-            blockFound = False
-
-            for r in range(rows):
-                if board[r][c] == 1:
-                    if not blockFound:
-                        h = rows - r
-                        columnHeights[c] = h
-                        aggregateHeight += h
-                        blockFound = True
-                elif blockFound and board[r][c] == 0:
-                    holes += 1
-
-        bumpiness = 0
-
-        #sum of absolute difference between adjacent column height
-        for c in range(cols - 1):
-            bumpiness += abs(columnHeights[c] - columnHeights[c+1])
-
-        score = (
-            HEIGHT_WEIGHT * aggregateHeight
-            + HOLES_WEIGHT * holes
-            + BUMPINESS_WEIGHT * bumpiness
-            + LINES_WEIGHT * currGameState.lines
-        )
-
-        return score
+    # how many queue pieces the search below a node can see: pieces further back never get placed before
+    # the horizon, so states that only differ there have the same value and can share a table entry
+    def relevantPieces(self, depth: int, isMaxAgent: bool):
+        # a max node at depth d places d - 1 pieces and checks the next one, a chance node places one more
+        return min(depth if isMaxAgent else depth + 1, 3)
@@ -35,9 +35,8 @@ the next piece for expectimax to handle
 #the python GUI thing (According to google summary)
 import tkinter as tk
 import time
-import random
-import copy
-from TetrisStateSpace import TetrisStateSpace, SHAPES
+from TetrisStateSpace import TetrisStateSpace, PIECE_TABLES
+from pieceSource import UniformPieces
 import sys 
 
 # config items
@@ -53,19 +52,21 @@ PIECE_COLORS = {
     "I": "cyan", "O": "yellow", "T": "purple", 
     "S": "green", "Z": "red", "J": "blue", "L": "orange"
 }
-PIECES = list(PIECE_COLORS.keys())
 
 class TetrisApp:
-    def __init__(self, agent, headless = False):
+    # every piece of the game comes from pieces (see pieceSource), by default uniformly random ones drawn
+    # with the given seed (None draws them from the global random module)
+    def __init__(self, agent, headless = False, seed = None, pieces = None):
         self.agent = agent
         self.headless = headless
         self.actions_taken = 0
+        self.pieces = pieces if pieces is not None else UniformPieces(seed)
         
         #Items that need to be initialized regardless of GUI or not GUI
         # make an empty board (logical)
         self.logical_board = [[0 for _ in range(COLS)] for _ in range(ROWS)]
         # make the game queue with 3 random pieces
-        self.queue = [random.choice(PIECES) for _ in range(3)]
+        self.queue = [self.pieces.next_piece() for _ in range(3)]
         # initial State Object
         self.current_state = TetrisStateSpace(self.logical_board, self.queue, 0)
         
@@ -147,27 +148,24 @@ class TetrisApp:
         
     #mini shape drawer for the queue 
     def draw_piece_preview(self, piece, x, y):
-        shape = SHAPES[piece][0] 
+        shape = PIECE_TABLES[piece][0]
         color = PIECE_COLORS[piece]
         
         # Mini cell size for preview
         mini_size = 20 
         
-        for r in range(len(shape)):
-            for c in range(len(shape[0])):
-                if shape[r][c] == 1:
-                    px = x + c * mini_size
-                    py = y + r * mini_size
-                    self.canvas.create_rectangle(
-                        px, py, px + mini_size, py + mini_size, 
-                        fill=color, outline="black"
-                    )
+        for r, c in shape.cells:
+            px = x + c * mini_size
+            py = y + r * mini_size
+            self.canvas.create_rectangle(
+                px, py, px + mini_size, py + mini_size, 
+                fill=color, outline="black"
+            )
 
     def animate_fall(self, piece_type, col, orientation, target_cells):
-        #grab shape grid to know what to draw
-        grid = SHAPES[piece_type][orientation]
-        grid_h = len(grid)
-        grid_w = len(grid[0])
+        #grab the precompiled shape to know what to draw
+        shape = PIECE_TABLES[piece_type][orientation]
+        grid_h = shape.height
         
         # Calculate the lowest row in the target (where it lands)
         if not target_cells: return
@@ -183,14 +181,12 @@ class TetrisApp:
             self.canvas.delete("anim")
             
             # Draw the piece at current row 'curr_r'
-            for r in range(grid_h):
-                for c in range(grid_w):
-                    if grid[r][c] == 1:
-                        draw_r = curr_r + r
-                        draw_c = col + c
-                        # Only draw if on screen
-                        if 0 <= draw_r < ROWS:
-                            self.draw_cell(draw_r, draw_c, color, tag="anim")
+            for r, c in shape.cells:
+                draw_r = curr_r + r
+                draw_c = col + c
+                # Only draw if on screen
+                if 0 <= draw_r < ROWS:
+                    self.draw_cell(draw_r, draw_c, color, tag="anim")
                             
             # Force Tkinter to redraw immediately
             self.root.update() 
@@ -251,9 +247,6 @@ class TetrisApp:
         #animate the falling
         self.animate_fall(current_piece_type, col, orientation, target_cells)
 
-        #randomly pick a piece for the queue
-        next_random_piece = random.choice(PIECES)
-
         #Update Logic
         try:
             #Update Color Board with the new piece before we clear
@@ -262,14 +255,15 @@ class TetrisApp:
                 self.color_board[r][c] = current_color
             
             #Like with last itratiuon, we make a temp logic board to detect which lines are full
-            temp_board = copy.deepcopy(self.current_state.board)
+            temp_board = [list(row) for row in self.current_state.board]
             for r, c in target_cells:
                 temp_board[r][c] = 1
                 
             full_rows = [r for r in range(ROWS) if all(temp_board[r][c] == 1 for c in range(COLS))]
 
             #Logic Transition
-            next_random_piece = random.choice(PIECES)
+            #randomly pick a piece for the queue
+            next_random_piece = self.pieces.next_piece()
             self.current_state = self.current_state.place_piece(col, orientation, next_random_piece)
             
             self.actions_taken += 1
@@ -305,7 +299,7 @@ class TetrisApp:
             
             # Logic Update
             try:
-                next_random_piece = random.choice(PIECES)
+                next_random_piece = self.pieces.next_piece()
                 self.current_state = self.current_state.place_piece(col, orientation, next_random_piece)
                 
                 self.actions_taken += 1
@@ -323,17 +317,26 @@ class TetrisApp:
         print(f"Time Elapsed:  {end_time - start_time:.2f}s")
 
     #game loop that takes input to control the number of pieces placed and rounds simulated.
-    def limitGameLoop(self, maxPiecesPlayed):
+    # depth is passed on to the agent's getAction (None: the agent's default), and how long every
+    # getAction call took is returned in move_times
+    def limitGameLoop(self, maxPiecesPlayed, depth = None):
         start_time = time.time()
+        end_time = start_time
+        move_times = []
 
         while not self.current_state.is_terminal():
             # grab action
-            action = self.agent.getAction(self.current_state)
+            move_start = time.perf_counter()
+            if depth is None:
+                action = self.agent.getAction(self.current_state)
+            else:
+                action = self.agent.getAction(self.current_state, depth)
+            move_times.append(time.perf_counter() - move_start)
             if action is None: 
                 break
             
             col, orientation = action
-            next_random_piece = random.choice(PIECES)
+            next_random_piece = self.pieces.next_piece()
 
             
             # Logic Update
@@ -352,7 +355,8 @@ class TetrisApp:
         return {
             "lines": self.current_state.lines,
             "pieces": self.actions_taken,
-            "time": end_time - start_time
+            "time": end_time - start_time,
+            "move_times": move_times
         }
 
 
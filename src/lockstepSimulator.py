@@ -0,0 +1,447 @@
+"""
+Lockstep simulation of many headless games at once.
+
+TetrisApp.limitGameLoop plays one game at a time and asks its agent for every move, so every game pays for
+its own successor generation and scoring, placement by placement, in Python. LockstepGames instead advances
+N independent games together, one piece per step, and works out the moves of all of them in the same step:
+    - without an agent, every game plays the one-ply greedy policy: the current piece goes where the
+      evaluator scores the resulting board highest
+    - with an agent, every game plays the moves agent.getAction picks (called with `depth` if one is given,
+      like limitGameLoop does). One agent plays every game: its caches (transposition table, subtree store)
+      only hold values that are the same whichever game filled them, so every game gets the moves it gets
+      on its own
+
+With NumPy and the classic evaluator the greedy policy and beamsearchChanceAgent (depth up to 3, without
+dedupe or sampling) are batched across games: every layer of every game's search is a handful of array
+operations over all of its candidate placements at once (PLACEMENTS lists the (piece, orientation, column)
+candidates of each piece):
+    - landing rows: every candidate slides down its board's packed rows, one row per operation, until
+      the first collision, which is what TetrisStateSpace._landing_row works out one placement at a time
+    - placement and line clears: the piece's row masks are OR-ed in, full rows are moved to the top and emptied
+    - scores: evaluation.evaluate_batch over all the resulting boards in one call
+For beamsearchChanceAgent the beam layers rank each game's candidates like pruneStates does, and the chance
+tail scores every piece on every last layer board with the same batched best response. The classic scores
+are exact integer features combined in a fixed order and ties are broken in the agent's own candidate order,
+so the moves are exactly those of playing every game on its own. Any other agent or setting is asked game by
+game, and without NumPy the greedy policy scores every game's TetrisStateSpace.successor_batch instead.
+
+Every game draws its pieces from its own piece source (see pieceSource), uniform or 7-bag ones seeded from
+`seed` or the sources given, so games are independent: game i sees the same pieces and plays the same moves
+whichever games run next to it and whenever they end.
+
+run returns one metrics dict per game in the shape limitGameLoop returns them: lines, pieces, time (the
+seconds from the start of the run until that game ended) and move_times. The games of a step are all moved
+at once, so each of them is given an even share of the step's time as the time of its move.
+"""
+
+import random
+import time
+
+from TetrisStateSpace import TetrisStateSpace, PIECES, PIECE_TABLES
+from evaluation import get_evaluator, evaluate_batch, combine
+from beamsearchChanceAgent import beamsearchChanceAgent
+from pieceSource import piece_source
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ROWS = TetrisStateSpace.ROWS
+COLUMNS = TetrisStateSpace.COLUMNS
+FULL_ROW = TetrisStateSpace.FULL_ROW
+
+# every (col, orientation) candidate of every piece, in legal_placements order, with the piece's row masks
+# shifted into that column (padded with empty masks to four grid rows) and its grid height
+PLACEMENTS = {
+    piece: [
+        ((col, orientation), [mask for _, mask in table.column_masks[col]] + [0] * (4 - table.height), table.height)
+        for orientation, table in PIECE_TABLES[piece].items()
+        for col in range(COLUMNS - table.width + 1)
+    ]
+    for piece in PIECES
+}
+
+# the order beamsearchChanceAgent.runChanceLayer sums the pieces of its chance layer in
+CHANCE_ORDER = ("O", "I", "S", "Z", "L", "J", "T")
+
+# candidate boards scored per evaluate_batch call in the chance tail, which keeps its arrays to a few tens of MB
+CHUNK_CANDIDATES = 16384
+
+
+def batches(agent):
+    """
+    Whether LockstepGames can batch agent's searches across games (None: the greedy policy)
+    """
+    return (isinstance(agent, beamsearchChanceAgent) and agent.evaluator == "classic" and agent.depth <= 3
+            and not agent.dedupe and agent.sampling is None)
+
+
+class LockstepGames:
+
+    def __init__(self, num_games, seed=0, evaluator="classic", source="uniform", agent=None, depth=None, sources=None):
+        """
+        Sets up num_games games from empty boards. Without an agent they play the greedy policy of evaluator,
+        otherwise the moves of agent (and its own evaluator). sources, if given, are the piece sources of the
+        games instead of ones seeded from seed.
+        """
+        self.agent = agent
+        self.depth = depth
+        self.evaluate, self.evaluate_successors = get_evaluator(evaluator)
+        self.vectorized = np is not None and (batches(agent) if agent is not None else evaluator == "classic")
+
+        if sources is None:
+            seeds = random.Random(seed)
+            # one piece source per game, so a game's pieces don't depend on how long the others last
+            sources = [piece_source(source, seeds.getrandbits(64)) for _ in range(num_games)]
+
+        self.sources = sources
+        empty = [[0] * COLUMNS for _ in range(ROWS)]
+        self.states = [TetrisStateSpace(empty, [pieces.next_piece() for _ in range(3)], 0) for pieces in self.sources]
+        self.pieces = [0] * len(self.sources)
+        self.live = list(range(len(self.sources)))
+
+        if self.vectorized:
+            # the candidate tables as arrays, each piece's candidates in one contiguous slice
+            self.moves = []
+            self.slices = {}
+            masks = []
+            heights = []
+
+            for piece in PIECES:
+                self.slices[piece] = (len(self.moves), len(self.moves) + len(PLACEMENTS[piece]))
+
+                for move, piece_masks, height in PLACEMENTS[piece]:
+                    self.moves.append(move)
+                    masks.append(piece_masks)
+                    heights.append(height)
+
+            self.masks = np.array(masks, dtype=np.int64)
+            self.heights = np.array(heights, dtype=np.int64)
+
+            # the drop profile of every candidate (see PieceOrientation), padded to four columns: the board
+            # column under each of its columns, whether the piece has that column and its top and bottom offsets
+            tables = [PIECE_TABLES[piece][orientation] for piece in PIECES for (_, orientation), _, _ in PLACEMENTS[piece]]
+            self.profile_columns = np.array([[min(col + j, COLUMNS - 1) for j in range(4)] for col, _ in self.moves])
+            self.profile_valid = np.array([[j < table.width for j in range(4)] for table in tables])
+            self.profile_tops = np.array([list(table.top) + [0] * (4 - table.width) for table in tables])
+            self.profile_bottoms = np.array([list(table.bottom) + [0] * (4 - table.width) for table in tables])
+
+    def expand(self, pieces):
+        """
+        The candidates of every piece of pieces, in legal_placements order, one run after the other, and the
+        index into pieces each of them belongs to
+        """
+        candidates = np.concatenate([np.arange(*self.slices[piece]) for piece in pieces])
+        counts = [self.slices[piece][1] - self.slices[piece][0] for piece in pieces]
+
+        return candidates, np.repeat(np.arange(len(pieces)), counts)
+
+    def place(self, boards, lines, candidates):
+        """
+        Plays candidate k on boards[k] (packed rows) with lines[k] lines. Returns the boards the placements
+        leave, with their full rows cleared, their lines counts and which of the placements are legal.
+        """
+        boards = boards.copy()
+        masks = self.masks[candidates]
+        heights = self.heights[candidates]
+        index = np.arange(len(candidates))
+
+        # slide every candidate down from the top row until it first collides: the last row it fit in is where it lands
+        landing = np.full(len(candidates), -1)
+        sliding = np.ones(len(candidates), dtype=bool)
+
+        for row in range(ROWS):
+            sliding &= row + heights <= ROWS
+
+            for i in range(4):
+                if row + i < ROWS:
+                    sliding &= (boards[:, row + i] & masks[:, i]) == 0
+
+            landing[sliding] = row
+
+        legal = landing >= 0
+
+        for i in range(4):
+            filled = legal & (i < heights)
+            boards[index[filled], landing[filled] + i] |= masks[filled, i]
+
+        # cleared rows move to the top (in a stable order, so the rest keep theirs) and are emptied there
+        full = boards == FULL_ROW
+        cleared = full.sum(axis=1)
+        boards = np.take_along_axis(boards, np.argsort(~full, axis=1, kind="stable"), axis=1)
+        boards[np.arange(ROWS) < cleared[:, None]] = 0
+
+        return boards, lines + cleared, legal
+
+    def best_moves(self, states):
+        """
+        The move every state's greedy policy plays (None if its piece can't be placed anywhere), scoring
+        every candidate of every state in one set of array operations
+        """
+        candidates, owner = self.expand([state.queue[0] for state in states])
+        boards = np.array([state.rows for state in states], dtype=np.int64)
+        lines = np.array([state.lines for state in states], dtype=np.int64)
+
+        boards, lines, legal = self.place(boards[owner], lines[owner], candidates)
+        scores = np.where(legal, evaluate_batch(boards, lines), -np.inf)
+
+        moves = []
+        start = 0
+
+        for count in np.bincount(owner, minlength=len(states)).tolist():
+            best = start + int(np.argmax(scores[start:start + count]))
+            moves.append(self.moves[candidates[best]] if legal[best] else None)
+            start += count
+
+        return moves
+
+    def best_responses(self, boards, lines, piece):
+        """
+        The best classic score of any placement of piece on every one of boards, -inf where it can't be
+        placed (evaluation.best_response, for many boards at once). Like TetrisStateSpace.placement_features,
+        a placement that rests on the skyline is scored from the board's skyline and the piece's drop profile;
+        only the ones that clear rows or slide in under an overhang (and all of them on a board that already
+        holds a full row) are placed and scored in full.
+        """
+        start, end = self.slices[piece]
+        count = end - start
+        per_chunk = max(CHUNK_CANDIDATES // count, 1)
+        best = np.empty(len(boards))
+
+        for first in range(0, len(boards), per_chunk):
+            chunk = slice(first, first + per_chunk)
+            best[chunk] = self.chunk_best_responses(boards[chunk], lines[chunk], start, end)
+
+        return best
+
+    def chunk_best_responses(self, boards, lines, start, end):
+        """
+        best_responses for one chunk of boards, with the piece's candidates start .. end - 1
+        """
+        n = len(boards)
+        candidates = np.arange(start, end)
+
+        # every board's skyline: column heights and the holes under them
+        filled = ((boards[:, :, None] >> np.arange(COLUMNS)) & 1).astype(bool)
+        heights = np.where(filled.any(axis=1), ROWS - filled.argmax(axis=1), 0)
+        holes = (np.logical_or.accumulate(filled, axis=1) & ~filled).sum(axis=(1, 2))
+
+        # (board, candidate, piece column) views of the profile and the heights under it
+        valid = self.profile_valid[candidates]
+        tops = self.profile_tops[candidates]
+        bottoms = self.profile_bottoms[candidates]
+        under = heights[:, self.profile_columns[candidates]]
+
+        # the piece drops until its lowest cell in some column meets that column's top
+        row = np.where(valid, ROWS - 1 - under - bottoms, ROWS).min(axis=2)
+        row = np.minimum(row, ROWS - self.heights[candidates])
+        overhang = (valid & (ROWS - under < tops)).any(axis=2)
+
+        clears = np.zeros((n, end - start), dtype=bool)
+        for i in range(4):
+            rows = np.take_along_axis(boards, np.clip(row + i, 0, ROWS - 1), axis=1)
+            clears |= (i < self.heights[candidates]) & ((rows | self.masks[candidates, i]) == FULL_ROW)
+
+        # and on a board that already holds a full row (see placement_features) every placement clears it
+        on_skyline = ~overhang & (row >= 0) & ~clears & ~(boards == FULL_ROW).any(axis=1)[:, None]
+
+        # the piece's columns rise to its top and every cell between its bottom and the old column top becomes a hole
+        new_heights = np.repeat(heights[:, None, :], end - start, axis=1)
+        new_holes = holes[:, None] + np.where(valid, ROWS - under - row[:, :, None] - bottoms - 1, 0).sum(axis=2)
+
+        for j in range(4):
+            columns = np.broadcast_to(self.profile_columns[candidates, j][None, :, None], (n, end - start, 1))
+            risen = np.where(valid[:, j], ROWS - row - tops[:, j], np.take_along_axis(new_heights, columns, axis=2)[:, :, 0])
+            np.put_along_axis(new_heights, columns, risen[:, :, None], axis=2)
+
+        scores = np.where(on_skyline, combine(new_heights.sum(axis=2), new_holes,
+                                              np.abs(np.diff(new_heights, axis=2)).sum(axis=2), lines[:, None]), -np.inf)
+
+        # the rest are placed for real, off the skyline
+        boards_left, candidates_left = np.nonzero(~on_skyline & (overhang | (row >= 0)))
+
+        if len(boards_left):
+            placed, placed_lines, legal = self.place(boards[boards_left], lines[boards_left], candidates[candidates_left])
+            scores[boards_left, candidates_left] = np.where(legal, evaluate_batch(placed, placed_lines), -np.inf)
+
+        return scores.max(axis=1)
+
+    def beam_moves(self, states):
+        """
+        The move beamsearchChanceAgent.getAction picks in every state. Each layer places the layer's piece on
+        the beam of every game at once, and each game keeps the same survivors pruneStates keeps.
+        """
+        agent = self.agent
+        known = min(agent.depth, 3)
+        moves = [None] * len(states)
+
+        # the beam entries of every game: board, lines, which game it belongs to and its initial move (a
+        # candidate index, -1 while there is none yet), each game's entries together and in pruneStates order
+        boards = np.array([state.rows for state in states], dtype=np.int64)
+        lines = np.array([state.lines for state in states], dtype=np.int64)
+        games = np.arange(len(states))
+        initial = np.full(len(states), -1)
+
+        # LAYERS 1 .. known - 1, every survivor of a game expanded in turn
+        for layer in range(known - 1):
+            if not len(games):
+                return moves
+
+            candidates, owner = self.expand([states[game].queue[layer] for game in games.tolist()])
+            placed, placed_lines, legal = self.place(boards[owner], lines[owner], candidates)
+
+            candidates, owner, placed, placed_lines = candidates[legal], owner[legal], placed[legal], placed_lines[legal]
+            scores = evaluate_batch(placed, placed_lines)
+            candidate_games = games[owner]
+            roots = np.where(initial[owner] >= 0, initial[owner], candidates)
+
+            # each game's candidates by score, highest first, ties in the order they were generated
+            ranking = np.lexsort((-scores, candidate_games)).tolist()
+            game_list = candidate_games.tolist()
+            root_list = roots.tolist()
+            survivors = []
+            kept = {}
+            per_root = {}
+
+            for k in ranking:
+                game = game_list[k]
+
+                if kept.get(game, 0) == agent.beam_width:
+                    continue
+
+                if agent.max_per_root is not None:
+                    if per_root.get((game, root_list[k]), 0) >= agent.max_per_root:
+                        continue
+                    per_root[(game, root_list[k])] = per_root.get((game, root_list[k]), 0) + 1
+
+                kept[game] = kept.get(game, 0) + 1
+                survivors.append(k)
+
+            # a game without a candidate plays the initial move of its best survivor so far (none at the root)
+            first_entries = {}
+            for entry, game in enumerate(games.tolist()):
+                first_entries.setdefault(game, entry)
+
+            for game, entry in first_entries.items():
+                if game not in kept and initial[entry] >= 0:
+                    moves[game] = self.moves[initial[entry]]
+
+            boards, lines = placed[survivors], placed_lines[survivors]
+            games, initial = candidate_games[survivors], roots[survivors]
+
+        if not len(games):
+            return moves
+
+        # LAST KNOWN LAYER: every placement of the piece at queue[known - 1] is scored by its tail
+        candidates, owner = self.expand([states[game].queue[known - 1] for game in games.tolist()])
+        placed, placed_lines, legal = self.place(boards[owner], lines[owner], candidates)
+
+        if agent.depth < 3:
+            # the next piece is still a known one, so the tail is just the best way to place it
+            values = np.empty(len(candidates))
+            next_pieces = np.array([states[game].queue[known] for game in games[owner].tolist()])
+
+            for piece in PIECES:
+                chosen = legal & (next_pieces == piece)
+                values[chosen] = self.best_responses(placed[chosen], placed_lines[chosen], piece)
+        else:
+            # summed piece by piece in the agent's order, so the averages are the very same floats
+            values = np.empty(len(candidates))
+            boards, lines = placed[legal], placed_lines[legal]
+            total = 0
+
+            for piece in CHANCE_ORDER:
+                total = total + self.best_responses(boards, lines, piece) * (1.0 / 7.0)
+
+            values[legal] = total
+
+        candidates, owner, values = candidates[legal], owner[legal], values[legal]
+        candidate_games = games[owner].tolist()
+        roots = np.where(initial[owner] >= 0, initial[owner], candidates).tolist()
+        best = {}
+
+        # the first of each game's best candidates, in the order they were generated
+        for k, game in enumerate(candidate_games):
+            if game not in best or values[k] > values[best[game]]:
+                best[game] = k
+
+        for game, k in best.items():
+            moves[game] = self.moves[roots[k]]
+
+        # a game whose survivors all top out plays the initial move of its first survivor
+        for entry, game in enumerate(games.tolist()):
+            if game not in best and moves[game] is None and initial[entry] >= 0:
+                moves[game] = self.moves[initial[entry]]
+
+        return moves
+
+    def step(self):
+        """
+        Plays one piece in every live game. Games that can't place their piece are over and drop out.
+        Returns the games that are still live.
+        """
+        states = [self.states[game] for game in self.live]
+
+        if self.vectorized and states:
+            moves = self.best_moves(states) if self.agent is None else self.beam_moves(states)
+        elif self.agent is not None:
+            moves = [self.agent.getAction(state) if self.depth is None else self.agent.getAction(state, self.depth)
+                     for state in states]
+        else:
+            moves = []
+
+            for state in states:
+                batch = state.successor_batch()
+                scores = self.evaluate_successors(batch)
+                moves.append(batch.moves[max(range(len(scores)), key=scores.__getitem__)] if scores else None)
+
+        still_live = []
+
+        for game, state, move in zip(self.live, states, moves):
+            if move is None:
+                continue
+
+            self.states[game] = state.place_piece(*move, self.sources[game].next_piece())
+            self.pieces[game] += 1
+            still_live.append(game)
+
+        self.live = still_live
+        return self.live
+
+    def run(self, max_pieces=None):
+        """
+        Plays every game until it is over or has placed max_pieces pieces and returns their metrics, in game order
+        """
+        start_time = time.time()
+        end_times = [start_time] * len(self.states)
+        move_times = [[] for _ in self.states]
+
+        while self.live:
+            if max_pieces is not None:
+                self.live = [game for game in self.live if self.pieces[game] < max_pieces]
+
+            playing = self.live
+
+            if not playing:
+                break
+
+            step_start = time.perf_counter()
+            self.step()
+            move_time = (time.perf_counter() - step_start) / len(playing)
+
+            # a game ends in the step it couldn't place its piece in, or after its last piece
+            now = time.time()
+            for game in playing:
+                end_times[game] = now
+                move_times[game].append(move_time)
+
+        return [
+            {
+                "lines": state.lines,
+                "pieces": pieces,
+                "time": end_time - start_time,
+                "move_times": times
+            }
+            for state, pieces, end_time, times in zip(self.states, self.pieces, end_times, move_times)
+        ]
@@ -0,0 +1,302 @@
+"""
+Microbenchmarks of the engine and agent hot paths, with regression baselines.
+
+benchmark.py and agentSimulator.py time whole games, where a change to one function is lost among
+everything else a move does and the games themselves change as soon as a move does. This times the hot
+paths one at a time, on a fixed corpus of boards:
+    legal_placements    every legal (col, orientation) of the current piece, on a board that hasn't cached them
+    _drop_location      the resting cells of every (col, orientation) of the current piece
+    place_piece         every legal placement of the current piece, on a board whose skyline is known
+    clone               one clone of the state
+    <agent>.evaluate    each agent's evaluationFunction on a board that hasn't cached its features
+    <agent>.getAction   one getAction call of each agent with its default settings (expectimax searches
+                        depth 2, its default depth 3 takes seconds a move), by a fresh agent so that no
+                        table or kept subtree of an earlier call helps it
+
+The corpus (CORPUS_BOARDS boards at each of the LEVELS stack heights) is generated from fixed seeds, so it
+is the same on every run and every checkout, and every benchmark is run and reported once per level:
+
+    python3 microbenchmark.py --json base.json
+    python3 microbenchmark.py --baseline base.json --tolerance 0.1
+
+Each benchmark is timed `--repeat` times (the cheap ones over at least MIN_CALLS calls per round) and reports
+the time of a single call, the minimum over the repeats (the least disturbed by the rest of the machine) and
+their median. With --baseline every benchmark is compared with the stored one: it regressed when its
+minimum is more than the tolerance slower, and its output changed when the digest of everything its calls
+returned differs, since a faster path has to return exactly what the old one did. Either makes the run exit
+with status 1. Baselines only compare against runs on the same machine and Python; record one on the commit
+a change starts from.
+"""
+
+import argparse
+import gc
+import hashlib
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+from TetrisStateSpace import TetrisStateSpace, PIECES, PIECE_TABLES
+from benchmark import AGENTS
+
+ROWS = TetrisStateSpace.ROWS
+COLUMNS = TetrisStateSpace.COLUMNS
+
+# mean column height of the boards at each stack level
+LEVELS = {"low": 4, "mid": 10, "high": 15}
+CORPUS_BOARDS = 8
+# getAction searches take up to seconds each, so they only get the first few boards of each level
+GET_ACTION_BOARDS = 2
+# the depth getAction is called with, where it isn't the agent's default
+GET_ACTION_DEPTHS = {"expectimax": 2}
+# the cheap benchmarks run their calls on fresh copies of the corpus until a round makes this many
+MIN_CALLS = 2000
+# chance of a cell under a column's top being empty
+HOLE_RATE = 0.1
+
+
+def corpus_board(level, index):
+    """
+    Board `index` of a stack level: columns within 2 rows of the level's height, with a few holes and
+    no full rows, and a random queue. Seeded with (level, index) only, so it never changes.
+    """
+    rng = random.Random(f"microbenchmark:{level}:{index}")
+    board = [[0] * COLUMNS for _ in range(ROWS)]
+
+    for c in range(COLUMNS):
+        height = max(0, min(ROWS - 4, LEVELS[level] + rng.randint(-2, 2)))
+
+        for r in range(ROWS - height, ROWS):
+            # the top cell is always filled so the column has the height it was given
+            board[r][c] = 1 if r == ROWS - height or rng.random() >= HOLE_RATE else 0
+
+    for row in board:
+        if all(row):
+            row[rng.randrange(COLUMNS)] = 0
+
+    return board, [rng.choice(PIECES) for _ in range(3)]
+
+
+def corpus(level, count=CORPUS_BOARDS):
+    """
+    Fresh states (nothing computed or cached yet) of the first count boards of a stack level
+    """
+    return [TetrisStateSpace(board, queue, 0) for board, queue in (corpus_board(level, i) for i in range(count))]
+
+
+def warm(state):
+    """
+    Works out the skyline, hash and features of a state, as every state the searches expand already has them
+    """
+    state.features
+    state.board_hash
+    return state
+
+
+def legal_placements_calls(level):
+    return [(state.legal_placements, ()) for state in corpus(level)]
+
+
+def drop_location_calls(level):
+    return [
+        (state._drop_location, (state.queue[0], col, orientation))
+        for state in corpus(level)
+        for orientation, table in PIECE_TABLES[state.queue[0]].items()
+        for col in range(COLUMNS - table.width + 1)
+    ]
+
+
+def place_piece_calls(level):
+    return [
+        (state.place_piece, (col, orientation, "T"))
+        for state in map(warm, corpus(level))
+        for col, orientation in state.legal_placements()
+    ]
+
+
+def clone_calls(level):
+    return [(state.clone, ()) for state in map(warm, corpus(level))]
+
+
+def evaluate_calls(agentName):
+    def calls(level):
+        agent = AGENTS[agentName](agentName)
+        return [(agent.evaluationFunction, (state,)) for state in corpus(level)]
+
+    return calls
+
+
+def get_action_calls(agentName):
+    def calls(level):
+        depth = (GET_ACTION_DEPTHS[agentName],) if agentName in GET_ACTION_DEPTHS else ()
+        return [(AGENTS[agentName](agentName).getAction, (state, *depth)) for state in corpus(level, GET_ACTION_BOARDS)]
+
+    return calls
+
+
+# every benchmark by name, with the function building the calls it times at a stack level and the fewest
+# calls a round of it makes
+BENCHMARKS = {
+    "legal_placements": (legal_placements_calls, MIN_CALLS),
+    "_drop_location": (drop_location_calls, MIN_CALLS),
+    "place_piece": (place_piece_calls, MIN_CALLS),
+    "clone": (clone_calls, MIN_CALLS),
+    **{f"{agentName}.evaluate": (evaluate_calls(agentName), MIN_CALLS) for agentName in AGENTS},
+    **{f"{agentName}.getAction": (get_action_calls(agentName), 1) for agentName in AGENTS},
+}
+
+
+def canonical(value):
+    """
+    A form of a benchmark's output that is the same on every run: states by their contents, not their identity
+    """
+    if isinstance(value, TetrisStateSpace):
+        return value.rows, tuple(value.queue), value.lines, value.placement
+
+    if isinstance(value, (list, tuple)):
+        return tuple(canonical(v) for v in value)
+
+    return value
+
+
+def run_benchmark(calls, repeat, min_calls):
+    """
+    Times `repeat` rounds of calls, each round on freshly built calls (calls(), untimed, as many times as it
+    takes to make min_calls of them) so that nothing one call cached helps another. Returns the seconds per
+    call of every round, how many calls a round makes and the digest of what the last round returned.
+    """
+    times = []
+
+    for _ in range(repeat):
+        round_calls = calls()
+
+        while len(round_calls) < min_calls:
+            round_calls += calls()
+
+        # like timeit, keep the garbage collector from running in the middle of some rounds but not others
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            results = [function(*args) for function, args in round_calls]
+            times.append((time.perf_counter() - start) / len(round_calls))
+        finally:
+            gc.enable()
+
+    digest = hashlib.sha1(repr(canonical(results)).encode()).hexdigest()[:16]
+    return times, len(round_calls), digest
+
+
+def run_suite(names=None, levels=None, repeat=5):
+    """
+    Runs the given benchmarks (all by default) at the given stack levels (all by default) and returns
+    their results by "benchmark[level]" name, in microseconds per call
+    """
+    results = {}
+
+    for name in names or BENCHMARKS:
+        for level in levels or LEVELS:
+            calls, min_calls = BENCHMARKS[name]
+            times, count, digest = run_benchmark(lambda: calls(level), repeat, min_calls)
+            results[f"{name}[{level}]"] = {
+                "us_min": min(times) * 1e6,
+                "us_median": statistics.median(times) * 1e6,
+                "calls": count,
+                "digest": digest,
+            }
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results with a baseline's. Returns a status per benchmark in both: "slower" past the
+    tolerance, "faster" by more than it, "changed" when the output differs, "ok" otherwise.
+    """
+    statuses = {}
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        base = baseline[name]
+        ratio = result["us_min"] / base["us_min"]
+
+        if result["digest"] != base["digest"]:
+            statuses[name] = "changed"
+        elif ratio > 1 + tolerance:
+            statuses[name] = "slower"
+        elif ratio < 1 - tolerance:
+            statuses[name] = "faster"
+        else:
+            statuses[name] = "ok"
+
+    return statuses
+
+
+def format_table(results, baseline=None, statuses=None):
+    """
+    Formats the results (and how they compare with the baseline) as a markdown table
+    """
+    if baseline is None:
+        lines = ["| Benchmark | Calls | Min (us) | Median (us) |", "|-----------|-------|----------|-------------|"]
+    else:
+        lines = [
+            "| Benchmark | Calls | Min (us) | Median (us) | Baseline (us) | Change | Status |",
+            "|-----------|-------|----------|-------------|---------------|--------|--------|",
+        ]
+
+    for name, r in results.items():
+        line = f"| {name} | {r['calls']} | {r['us_min']:.2f} | {r['us_median']:.2f} |"
+
+        if baseline is not None:
+            if name in baseline:
+                base = baseline[name]["us_min"]
+                line += f" {base:.2f} | {(r['us_min'] / base - 1) * 100:+.1f}% | {statuses[name]} |"
+            else:
+                line += " - | - | new |"
+
+        lines.append(line)
+
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the engine and agent hot paths on a fixed corpus of boards.")
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), help="benchmarks to run (default: all)")
+    parser.add_argument("--levels", nargs="+", choices=list(LEVELS), help="stack levels to run them at (default: all)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed rounds of every benchmark")
+    parser.add_argument("--json", help="write the results to this file, to compare later runs with")
+    parser.add_argument("--baseline", help="compare the results with the ones stored in this file")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="slowdown that counts as a regression (0.1: 10%%)")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.benchmarks, args.levels, args.repeat)
+    baseline = statuses = None
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        statuses = compare(results, baseline, args.tolerance)
+
+    print(format_table(results, baseline, statuses))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, f, indent=2)
+
+    if statuses:
+        failed = [name for name, status in statuses.items() if status in ("slower", "changed")]
+
+        if failed:
+            print(f"\n{len(failed)} of {len(statuses)} benchmarks regressed or changed their output: {', '.join(failed)}")
+            return 1
+
+        print(f"\nall {len(statuses)} benchmarks within {args.tolerance:.0%} of the baseline")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+Root-parallel search for the agents.
+
+The subtrees below different root moves (or beam survivors) are independent, so they can be searched on
+different cores. A RootPool keeps a ProcessPoolExecutor of long-lived workers, each of which builds its own
+copy of the agent once, in the pool initializer, and keeps it (and its transposition table) for every
+later task. A task names an agent method, the state to call it on and its other arguments; the state travels
+in the compact form of TetrisStateSpace.pack, and a worker that gets the same state several times in a row
+(one task per root move) unpacks it only once so its placement caches are reused.
+
+Results come back in task order, so the agents pick their move from exactly the values and in exactly the
+order of a sequential search. Agents own their pool through the PooledAgent mixin.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+from TetrisStateSpace import TetrisStateSpace
+
+# the agent of this worker process, and the last state it unpacked
+_worker_agent = None
+_worker_state = (None, None)
+
+
+def _init_worker(agentClass, settings):
+    global _worker_agent
+    _worker_agent = agentClass(**settings)
+
+
+def _call(method, packed, args):
+    global _worker_state
+
+    if _worker_state[0] != packed:
+        _worker_state = (packed, TetrisStateSpace.unpack(packed))
+
+    return getattr(_worker_agent, method)(_worker_state[1], *args)
+
+
+class RootPool:
+
+    def __init__(self, agentClass, settings, workers):
+        """
+        Starts `workers` processes that each build agentClass(**settings). The settings must leave the
+        workers' agents sequential.
+        """
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                            initargs=(agentClass, settings))
+
+    def map(self, method, state, argsList):
+        """
+        Calls agent.method(state, *args) in the workers for every args of argsList and returns the results in order
+        """
+        packed = state.pack()
+        futures = [self.executor.submit(_call, method, packed, tuple(args)) for args in argsList]
+
+        return [future.result() for future in futures]
+
+    def map_states(self, method, states):
+        """
+        Calls agent.method(state) in the workers for every state of states and returns the results in order
+        """
+        futures = [self.executor.submit(_call, method, state.pack(), ()) for state in states]
+
+        return [future.result() for future in futures]
+
+    def close(self):
+        self.executor.shutdown()
+
+
+class PooledAgent:
+    """
+    The worker pool of an agent that searches with `workers` processes: started on first use with the
+    settings workerSettings() returns, kept for later moves and shut down by close(). The agent sets
+    self.workers and self.pool (None) itself.
+    """
+
+    def workerSettings(self):
+        """
+        The keyword arguments the worker processes build their own copy of this agent with, which must
+        leave it sequential
+        """
+        raise NotImplementedError
+
+    def rootPool(self):
+        """
+        The agent's RootPool, started on first use
+        """
+        if self.pool is None:
+            self.pool = RootPool(type(self), self.workerSettings(), self.workers)
+        return self.pool
+
+    def close(self):
+        """
+        Shuts the worker processes down, a later parallel search starts new ones
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
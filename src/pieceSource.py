@@ -0,0 +1,118 @@
+"""
+Piece sources for the simulators.
+
+Every simulator loop draws the pieces of its game from a piece source, an object whose next_piece() returns
+the next piece letter. Two games given sources with the same settings see exactly the same pieces, so A/B
+comparisons of agents or settings can be run on identical games:
+    UniformPieces(seed)         every piece drawn uniformly at random, in the order TetrisApp always drew them
+                                (seed None: from the global random module, like it did before it took a seed)
+    BagPieces(seed)             the 7-bag randomizer of modern Tetris: all seven pieces in a shuffled order,
+                                then the next shuffled bag, so no piece is ever more than 12 draws away
+    SequenceFilePieces(path)    a recorded sequence, replayed from a file
+
+Sequence files hold one ASCII piece letter per byte and nothing else, so they can be inspected with any
+text tool and a million pieces take a megabyte. They are memory-mapped and read lazily, one byte per draw,
+so replaying a long game never loads the whole file. write_sequence records any source into one:
+
+    python3 pieceSource.py games.seq --count 100000 --kind bag --seed 1
+"""
+
+import argparse
+import mmap
+import random
+
+from TetrisStateSpace import TetrisStateSpace, PIECES
+
+# the order TetrisApp has always drawn its uniform pieces from, so a seed keeps dealing the same game
+DRAW_ORDER = ("I", "O", "T", "S", "Z", "J", "L")
+
+
+class UniformPieces:
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed) if seed is not None else random
+
+    def next_piece(self):
+        return self.rng.choice(DRAW_ORDER)
+
+
+class BagPieces:
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed) if seed is not None else random
+        self.bag = []
+
+    def next_piece(self):
+        if not self.bag:
+            self.bag = list(PIECES)
+            self.rng.shuffle(self.bag)
+            # drawn from the end, so reverse to hand the pieces out in the shuffled order
+            self.bag.reverse()
+
+        return self.bag.pop()
+
+
+class SequenceFilePieces:
+
+    def __init__(self, path, start=0):
+        """
+        Replays the pieces of a sequence file from its `start`-th piece on
+        """
+        self.path = path
+        self.position = start
+
+        with open(path, "rb") as f:
+            # an empty file can't be mapped, and has no pieces to hand out anyway
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if f.seek(0, 2) else b""
+
+    def next_piece(self):
+        if self.position >= len(self.data):
+            raise EOFError(f"piece sequence '{self.path}' ran out after {len(self.data)} pieces")
+
+        piece = chr(self.data[self.position])
+
+        if piece not in TetrisStateSpace.VALID_SHAPES:
+            raise ValueError(f"invalid piece '{piece}' at position {self.position} of '{self.path}'")
+
+        self.position += 1
+        return piece
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+# the seeded sources simulators can be told to use by name
+SOURCES = {
+    "uniform": UniformPieces,
+    "bag": BagPieces,
+}
+
+
+def piece_source(kind, seed=None):
+    """
+    Builds the seeded piece source registered under kind
+    """
+    if kind not in SOURCES:
+        raise ValueError(f"unknown piece source '{kind}', expected one of {sorted(SOURCES)}")
+
+    return SOURCES[kind](seed)
+
+
+def write_sequence(path, source, count):
+    """
+    Draws count pieces from source and records them in a sequence file at path
+    """
+    with open(path, "wb") as f:
+        f.write("".join(source.next_piece() for _ in range(count)).encode("ascii"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record a replayable piece sequence file.")
+    parser.add_argument("path")
+    parser.add_argument("--count", type=int, default=100000, help="pieces to record")
+    parser.add_argument("--kind", choices=sorted(SOURCES), default="uniform")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_sequence(args.path, piece_source(args.kind, args.seed), args.count)
@@ -0,0 +1,152 @@
+"""
+What the two expectimax agents have in common.
+
+expectimaxAgent and beamPrunedExpectimaxAgent search the same kind of tree (max nodes over placements, chance
+nodes over the piece drawn next) and only differ in which children a max node expands and how depth counts
+down. Everything around the search itself is the same for both and lives in SearchAgent:
+    - the shared settings: transposition table, evaluator, chance node sampling, dedupe and the subtree store
+    - getAction, which resumes the subtree store (see searchTree) around chooseAction
+    - chooseAction's three modes: anytime (see searchDeadline), root-parallel (see parallelSearch) and a
+      plain fixed depth search over the root moves
+    - the search variant keying their values in the transposition table, and the afterstates going
+      through the subtree store
+
+An agent subclasses it with its DEFAULT_DEPTH, expectiMax, relevantPieces, the depths its anytime search
+runs (deepeningDepths) and the settings its worker processes are built with (workerSettings).
+"""
+
+from TetrisStateSpace import TetrisStateSpace
+from transpositionTable import TranspositionTable
+from evaluation import get_evaluator, PLACEMENT_EVALUATORS
+from searchDeadline import Deadline, iterative_deepening
+from parallelSearch import PooledAgent
+from chanceSampling import ChanceSampler
+from searchTree import SubtreeStore
+
+
+class SearchAgent(PooledAgent):
+    DEFAULT_DEPTH = 2
+
+    def __init__(self, agentName: str, variant: tuple, transposition_table: TranspositionTable = None,
+                 evaluator: str = "classic", workers: int = None, sampling: ChanceSampler = None,
+                 tree_memory_mb: float = 64, dedupe: bool = False):
+        self.agentName = agentName
+        self.transpositions = transposition_table if transposition_table is not None else TranspositionTable()
+        self.evaluator = evaluator
+        self.evaluate, self.evaluateSuccessors = get_evaluator(evaluator)
+        self.sampling = sampling
+        self.dedupe = dedupe
+        # agents of the same kind and settings compute the same values, so they share table entries
+        self.variant = variant
+        self.searchVariant = variant
+        # max nodes are keyed with the move that produced them when the evaluator scores it
+        self.keyPlacement = evaluator in PLACEMENT_EVALUATORS
+        self.searchRootDepth = None
+        self.deadline = None
+        # depth of the last anytime search that finished in time (0: only the static evaluation did)
+        self.searchDepth = None
+        self.workers = workers
+        self.pool = None
+        self.tree = SubtreeStore(memory_cap_mb=tree_memory_mb) if tree_memory_mb else None
+
+    # keeps the caches of the previous search's subtree for the branch the game took (see searchTree)
+    def getAction(self, currGameState: TetrisStateSpace, depth: int = None, deadline_ms: float = None):
+        if depth is None:
+            depth = self.DEFAULT_DEPTH
+
+        if self.tree is not None:
+            currGameState = self.tree.begin(currGameState)
+
+        bestMove = self.chooseAction(currGameState, depth, deadline_ms)
+
+        if self.tree is not None:
+            self.tree.finish(bestMove)
+
+        return bestMove
+
+    # with a deadline_ms time budget, the depths of deepeningDepths are searched until the time runs out instead
+    def chooseAction(self, currGameState: TetrisStateSpace, depth: int, deadline_ms: float = None):
+        #loops over all potential moves and returns the one with the highest score
+        possibleMoves = currGameState.legal_placements(self.dedupe)
+
+        if not possibleMoves:
+            return None
+
+        if deadline_ms is not None:
+            return self.iterativeDeepening(currGameState, self.deepeningDepths(depth), deadline_ms)
+
+        if self.workers:
+            # every root move is searched in a worker process, the best is picked from their values here
+            scores = self.rootPool().map("rootValue", currGameState, [(depth, move) for move in possibleMoves])
+            bestScore = -float("inf")
+            bestMove = None
+
+            for move, score in zip(possibleMoves, scores):
+                if score > bestScore:
+                    bestScore = score
+                    bestMove = move
+
+            return bestMove
+
+        return self.searchAction(currGameState, depth, possibleMoves)
+
+    # the fixed depth search in this process: every root move's value, keeping the first of the best
+    def searchAction(self, currGameState: TetrisStateSpace, depth: int, possibleMoves):
+        self.startSearch(depth)
+        bestScore = -float("inf")
+        bestMove = None
+
+        for (col, orientation) in possibleMoves:
+            # but expectiMax now properly alternates max/chance and uses depth
+            score = self.expectiMax(currGameState, depth, (col, orientation), False)
+            if score > bestScore:
+                bestScore = score
+                bestMove = (col, orientation)
+
+        return bestMove
+
+    # anytime search: runs the fixed depth search at each of depths in turn, best move of the previous one
+    # first, and keeps the result of the deepest one that finishes before the deadline
+    def iterativeDeepening(self, currGameState: TetrisStateSpace, depths, deadline_ms: float):
+        successors = currGameState.successor_batch(self.dedupe)
+        self.deadline = Deadline(deadline_ms)
+
+        try:
+            bestMove, self.searchDepth = iterative_deepening(
+                successors.moves, self.evaluateSuccessors(successors), depths,
+                lambda move, depth: self.rootValue(currGameState, depth, move))
+        finally:
+            self.deadline = None
+
+        return bestMove
+
+    # the depths the anytime search runs, up to depth
+    def deepeningDepths(self, depth: int):
+        return range(1, depth + 1)
+
+    # whether a chance node is sampled depends on how far below the root it is, so sampled values are
+    # only shared (through the table) between searches from the same root depth
+    def startSearch(self, depth: int):
+        self.searchRootDepth = depth
+        if self.sampling is not None:
+            self.searchVariant = self.variant + (self.sampling.variant(), depth)
+
+    def rootValue(self, currGameState: TetrisStateSpace, depth: int, move):
+        self.startSearch(depth)
+        return self.expectiMax(currGameState, depth, move, False)
+
+    # the worker processes of the parallel root search leave the subtree store off
+    def workerSettings(self):
+        return {"agentName": self.agentName, "evaluator": self.evaluator, "sampling": self.sampling,
+                "tree_memory_mb": 0, "dedupe": self.dedupe}
+
+    # afterstates go through the subtree store, which hands back the ones an earlier search already built
+    def buildAfterstate(self, gameState: TetrisStateSpace, action, build):
+        if self.tree is None:
+            return build()
+        return self.tree.afterstate(gameState, action, build)
+
+    # Referencing Pierre Dellacherie's Algorithm
+    # modify this to also make this take the queue's "fit" to the board
+    def evaluationFunction(self, currGameState: TetrisStateSpace):
+        return self.evaluate(currGameState)
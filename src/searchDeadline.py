@@ -0,0 +1,63 @@
+"""
+Anytime (iterative deepening) search for the expectimax agents.
+
+A fixed depth search takes as long as it takes, which can be seconds per move on a high stack. With a
+deadline the agents instead search depth after depth until the time runs out:
+    - before any search, every root move is scored by the static evaluation of its child, so there is
+      always a move to fall back on
+    - each iteration searches the root moves best first, ordered by the scores of the previous iteration,
+      so on equal scores the move the shallower search preferred wins
+    - the search checks the deadline at every node and raises SearchTimeout once it has passed, which
+      abandons the unfinished iteration; the best move of the deepest finished iteration is returned
+
+Values the transposition table picked up during earlier iterations (and the abandoned one) are complete
+subtree values keyed by remaining depth, so deeper iterations reuse them instead of searching them again.
+"""
+
+import time
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside a search when its deadline has passed
+    """
+
+
+class Deadline:
+
+    def __init__(self, deadline_ms):
+        self.expires = time.perf_counter() + deadline_ms / 1000
+
+    def check(self):
+        """
+        Raises SearchTimeout if the deadline has passed
+        """
+        if time.perf_counter() >= self.expires:
+            raise SearchTimeout()
+
+
+def iterative_deepening(moves, static_scores, depths, score_move):
+    """
+    Runs one root search per depth in depths, scoring each move with score_move(move, depth), until one of
+    them raises SearchTimeout. moves and static_scores are the root moves and their static evaluations.
+    Returns the best move of the deepest finished iteration and that depth (0 if none finished).
+    """
+    scores = dict(zip(moves, static_scores))
+    best_move = max(moves, key=scores.__getitem__)
+    completed = 0
+
+    try:
+        for depth in depths:
+            ordered = sorted(moves, key=scores.__getitem__, reverse=True)
+            new_scores = {}
+
+            for move in ordered:
+                new_scores[move] = score_move(move, depth)
+
+            scores = new_scores
+            best_move = max(ordered, key=scores.__getitem__)
+            completed = depth
+    except SearchTimeout:
+        pass
+
+    return best_move, completed
@@ -0,0 +1,118 @@
+"""
+Reuse of the previous search's tree between consecutive moves.
+
+Our searches are depth limited, so the values a search computed for the positions below the move it chose
+are keyed by a different remaining depth when the next search reaches them again; those are left to the
+transposition table. What does carry over is the work that only depends on the board: the afterstates the
+search built and the placement caches (landing rows and legal placements) of every state spawned from them.
+The next search visits the same boards again, one placement deeper, and without this every one of them is
+worked out from scratch.
+
+A SubtreeStore records every afterstate a search builds, grouped by the root move it was built under.
+When the next search starts from the state the game actually reached (the chosen move's afterstate plus the
+piece that was drawn), the group of the chosen move is kept and every other group is dropped: the kept
+afterstates are handed back instead of new ones whenever the search reaches them again, and the new root
+itself shares the caches of the realized afterstate. If the game went somewhere else (a different move was
+played, or the state was built by hand) nothing is kept.
+
+The store holds at most `max_nodes` afterstates (kept and new together) and stops recording once it is
+full. Each one, with the placement caches of its spawned states, takes roughly NODE_BYTES of memory,
+which is how `memory_cap_mb` is turned into a node count.
+"""
+
+
+class SubtreeStore:
+    NODE_BYTES = 8192
+
+    def __init__(self, max_nodes=20000, memory_cap_mb=None):
+        if memory_cap_mb is not None:
+            max_nodes = int(memory_cap_mb * 1024 * 1024) // self.NODE_BYTES
+
+        self.max_nodes = max_nodes
+        self.root = None
+        self.lastRoot = None
+        self.lastMove = None
+        self.branches = {}
+        self.current = {}
+        self.retained = {}
+        self.size = 0
+        self.resumed = 0
+        self.hits = 0
+
+    @staticmethod
+    def key(state, move):
+        # an afterstate's board only depends on the board, the piece being placed and the move. The rest of
+        # the queue is left out: the piece drawn last only sits at the back of it, and the transposition
+        # table means a search mostly builds the subtree of just one of the seven drawn pieces
+        return (state.board_hash, state.queue[0], state.lines, move)
+
+    def begin(self, root):
+        """
+        Starts a new search from root. Returns the state to search from: root itself, or an identical
+        state that shares the caches of the realized afterstate if root is where the last chosen move led.
+        """
+        realized = None
+
+        if self.lastRoot is not None and self.lastMove is not None:
+            realized = self.branches.get(self.lastMove, {}).get(self.key(self.lastRoot, self.lastMove))
+
+        if (realized is not None and realized.rows == root.rows and realized.lines == root.lines
+                and realized.queue == root.queue[:2]):
+            self.retained = self.branches[self.lastMove]
+            root = realized.spawn(root.queue[2])
+            self.resumed += 1
+        else:
+            self.retained = {}
+
+        self.branches = {}
+        self.current = {}
+        self.size = len(self.retained)
+        self.root = root
+
+        return root
+
+    def afterstate(self, state, move, build):
+        """
+        Returns the afterstate of playing move on state: the one a search already built if there is one,
+        otherwise build(), which is then recorded under the current root move.
+        """
+        key = self.key(state, move)
+
+        if state is self.root:
+            # every afterstate built from here on belongs to this root move, until the next one starts
+            self.current = self.branches.setdefault(move, {})
+
+        found = self.current.get(key)
+
+        if found is None:
+            found = self.retained.get(key)
+
+            if found is None:
+                found = build()
+            else:
+                self.hits += 1
+
+            if self.size < self.max_nodes:
+                self.current[key] = found
+                self.size += 1
+
+        # the key leaves the queue tail out, so a sibling that only differs in the piece drawn last gets the
+        # recorded afterstate with its own queue
+        if found.queue != state.queue[1:]:
+            found = found.requeue(state.queue[1:])
+
+        return found
+
+    def finish(self, move):
+        """
+        Records the move the search chose, so the next search can tell whether the game followed it
+        """
+        self.lastRoot = self.root
+        self.lastMove = move
+
+    def stats(self):
+        return {
+            "nodes": self.size,
+            "resumed": self.resumed,
+            "hits": self.hits
+        }
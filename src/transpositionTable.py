@@ -0,0 +1,110 @@
+"""
+A bounded transposition table for the expectimax agents.
+
+Different move orders can reach the same (board, queue) position, and without a table the search evaluates
+the whole subtree below it every time. Values are stored under a key built from the state's Zobrist hash,
+its lines count (the evaluation rewards lines, so two states with the same board but different line totals
+have different values), the remaining depth and the node type. Chance nodes also include the action being
+averaged over, since in our agents a chance node is a (state, action) pair.
+
+Only the part of the queue the remaining search will actually place is hashed (`pieces`). The random piece
+a chance node draws enters at the back of the queue, so within a short horizon the seven children of a
+chance node only differ in pieces that are never placed; hashing the used prefix lets them share one entry.
+
+A max node one placement above the horizon scores its own state, so under an evaluator that reads the
+placement that produced the state (see evaluation.PLACEMENT_EVALUATORS) its value also depends on the move
+that led to it. Max keys then carry that placement as well, where chance keys carry their action.
+
+Finally every key carries the
+search variant of the agent that stored it, because the agents compute different values for the same node
+(beam pruning drops moves, and the agents count depth differently); agents of the same kind and settings
+can share a table, different kinds never read each other's values.
+
+The table holds at most `max_entries` values and evicts the least recently used one when it is full.
+Hits, misses and evictions are counted so benchmark runs can report how well the table is doing.
+Zobrist hashes are 64 bits, so the odds of two different positions sharing a key are negligible.
+"""
+
+from collections import OrderedDict
+
+MAX_NODE = 0
+CHANCE_NODE = 1
+
+
+class TranspositionTable:
+
+    def __init__(self, max_entries=200000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def max_key(state, depth, variant=None, pieces=3, placement=False):
+        """
+        Key of a max node: the state itself at the given remaining depth, and with placement the move
+        that produced it
+        """
+        return (state.zobrist_prefix(pieces), state.lines, depth, MAX_NODE, state.placement if placement else None, variant)
+
+    @staticmethod
+    def chance_key(state, depth, action, variant=None, pieces=3):
+        """
+        Key of a chance node: the state and the (col, orientation) about to be placed
+        """
+        return (state.zobrist_prefix(pieces), state.lines, depth, CHANCE_NODE, action, variant)
+
+    def lookup(self, key):
+        """
+        Returns the stored value for key, or None if it is not in the table
+        """
+        value = self.entries.get(key)
+
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def store(self, key, value):
+        """
+        Stores a value, evicting the least recently used entry if the table is full
+        """
+        if self.max_entries <= 0:
+            return
+
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        """
+        Returns the hit/miss statistics of this table as a dict
+        """
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate()
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)